@@ -624,13 +624,14 @@ def get_all_tools(user=None):
 
 # ─── Tool Execution ─────────────────────────────────────────────────────────
 
-def execute_tool(tool_name, tool_input, user):
+def execute_tool(tool_name, tool_input, user, cache_write=True):
     """Execute an ERPNext tool call. All queries run as the specified user.
-    Phase 6.1: Checks Redis cache first for read-only tools."""
+    Phase 6.1: Checks Redis cache first for read-only tools.
+    cache_write=False leaves storing the result to the caller."""
 
     # Phase 6.1: Check cache before executing
     try:
-        from .query_cache import get_cached_result, set_cached_result
+        from .query_cache import get_cached_result
         cached = get_cached_result(tool_name, tool_input)
         if cached is not None:
             return cached
@@ -643,11 +644,12 @@ def execute_tool(tool_name, tool_input, user):
         result = _dispatch_tool(tool_name, tool_input, user, original_user)
 
         # Phase 6.1: Cache the result for future identical queries
-        try:
-            from .query_cache import set_cached_result as _cache_set
-            _cache_set(tool_name, tool_input, result)
-        except Exception:
-            pass  # Cache write is non-critical
+        if cache_write:
+            try:
+                from .query_cache import set_cached_result as _cache_set
+                _cache_set(tool_name, tool_input, result)
+            except Exception:
+                pass  # Cache write is non-critical
 
         return result
 
@@ -1476,6 +1478,26 @@ def _auto_summarize_records(records, tool_input):
     return summary
 
 
+def _tool_result_content(tool_name, tool_input, user):
+    """
+    Execute a tool and encode its distilled result for the tool_result block.
+    Compact tools pass distillation unchanged, so that one encoding is
+    also what gets cached — the result is serialized once, not twice.
+    """
+    result = execute_tool(tool_name, tool_input, user, cache_write=False)
+    distilled = _distill_tool_result(tool_name, tool_input, result)
+    content = json.dumps(distilled, default=str)
+
+    if isinstance(result, dict) and not result.get("_from_cache"):
+        try:
+            from .query_cache import set_cached_result
+            set_cached_result(tool_name, tool_input, result,
+                              result_json=content if distilled is result else None)
+        except Exception:
+            pass  # Cache write is non-critical
+    return content
+
+
 def _distill_tool_result(tool_name, tool_input, raw_result):
     """
     Distill a tool result to only the fields Claude needs for analysis.
@@ -1846,12 +1868,10 @@ def process_chat(user, question, conversation_history=None, image_data=None):
             for block in content_blocks:
                 if block.get("type") == "tool_use":
                     tool_calls_made += 1
-                    tool_result = execute_tool(block["name"], block["input"], user)
-                    distilled = _distill_tool_result(block["name"], block.get("input", {}), tool_result)
                     tool_results.append({
                         "type": "tool_result",
                         "tool_use_id": block["id"],
-                        "content": json.dumps(distilled, default=str),
+                        "content": _tool_result_content(block["name"], block["input"], user),
                     })
             messages.append({"role": "user", "content": tool_results})
 
@@ -1986,7 +2006,7 @@ def _stream_claude_response(messages, system_prompt, tools, cache_key, text_so_f
     Parses SSE events, writes text tokens to Redis in real-time.
     Returns result dict with accumulated text, content blocks, and usage.
     """
-    from .providers import _call_anthropic_stream as get_stream_response
+    from .providers import _call_anthropic_stream as get_stream_response, iter_anthropic_events
 
     if not model_doc:
         error_msg = "No model configured for streaming."
@@ -2026,19 +2046,7 @@ def _stream_claude_response(messages, system_prompt, tools, cache_key, text_so_f
     cache_creation_input_tokens = 0
     last_update_len = len(accumulated_text)
 
-    for line in resp.iter_lines(decode_unicode=True):
-        if not line or not line.startswith("data: "):
-            continue
-
-        data_str = line[6:]
-        if data_str.strip() == "[DONE]":
-            break
-
-        try:
-            event = json.loads(data_str)
-        except json.JSONDecodeError:
-            continue
-
+    for event in iter_anthropic_events(resp):
         event_type = event.get("type", "")
 
         if event_type == "message_start":
@@ -2393,12 +2401,10 @@ def process_chat_stream(user, question, conversation_history=None, stream_id=Non
                             text=full_text, tool_status=tool_label,
                             tool_calls=tool_calls_made,
                         )
-                        tool_result = execute_tool(block["name"], block["input"], user)
-                        distilled = _distill_tool_result(block["name"], block.get("input", {}), tool_result)
                         tool_results.append({
                             "type": "tool_result",
                             "tool_use_id": block["id"],
-                            "content": json.dumps(distilled, default=str),
+                            "content": _tool_result_content(block["name"], block["input"], user),
                         })
                 messages.append({"role": "user", "content": tool_results})
 
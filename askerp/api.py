@@ -24,6 +24,7 @@ Endpoints:
   POST /api/method/askerp.api.transcribe_audio — Voice-to-text via Whisper (Phase 4.3)
   GET  /api/method/askerp.api.search_sessions — Search past conversations (Phase 5.3)
   POST /api/method/askerp.api.test_connection — Test a model's API connectivity
+  POST /api/method/askerp.api.test_all_connections — Test every enabled model at once
 """
 
 import json
@@ -1495,6 +1496,32 @@ def test_connection(model_name):
         return {"success": False, "message": str(e)[:300]}
 
 
+@frappe.whitelist()
+def test_all_connections():
+    """
+    Test every enabled AI model's API connectivity. Called from AskERP Settings.
+    Models are tested side by side and the results recorded in one UPDATE.
+
+    Returns:
+        dict: {success: bool, results: [{model, success, message}]}
+    """
+    user = frappe.session.user
+    if "System Manager" not in frappe.get_roles(user):
+        frappe.throw(_("Only System Manager can test model connections."), frappe.PermissionError)
+
+    try:
+        from .providers import test_connection_batch
+        names = frappe.get_all("AskERP Model", filters={"enabled": 1}, pluck="name", order_by="name asc")
+        model_docs = [frappe.get_doc("AskERP Model", name) for name in names]
+        results = test_connection_batch(model_docs)
+        return {
+            "success": True,
+            "results": [{"model": name, **result} for name, result in zip(names, results)],
+        }
+    except Exception as e:
+        return {"success": False, "message": str(e)[:300]}
+
+
 # ─── Conversation Search Endpoint (Phase 5.3) ────────────────────────────────
 
 @frappe.whitelist()
@@ -1702,7 +1729,7 @@ def delete_preference(key):
         return {"success": False}
 
     try:
-        from .memory import get_user_preferences
+        from .memory import get_user_preferences, set_user_preferences
 
         if not frappe.db.has_column("User", "custom_ai_preferences"):
             return {"success": False, "message": "Preferences not available"}
@@ -1710,9 +1737,7 @@ def delete_preference(key):
         prefs = get_user_preferences(user)
         if key in prefs:
             del prefs[key]
-            frappe.db.set_value("User", user, "custom_ai_preferences",
-                                json.dumps(prefs, ensure_ascii=False), update_modified=False)
-            frappe.db.commit()
+            set_user_preferences(user, prefs)
 
         return {"success": True}
 
@@ -1734,12 +1759,12 @@ def clear_preferences():
         return {"success": False}
 
     try:
+        from .memory import set_user_preferences
+
         if not frappe.db.has_column("User", "custom_ai_preferences"):
             return {"success": False, "message": "Preferences not available"}
 
-        frappe.db.set_value("User", user, "custom_ai_preferences",
-                            "{}", update_modified=False)
-        frappe.db.commit()
+        set_user_preferences(user, {})
         return {"success": True}
 
     except Exception as e:
@@ -4,3 +4,11 @@ from frappe.model.document import Document
 
 class AIChatSession(Document):
     pass
+
+
+def on_doctype_update():
+    """
+    Composite index for memory reads: every memory query filters by user
+    and orders by modified desc, so this turns the filesort into a range scan.
+    """
+    frappe.db.add_index("AI Chat Session", ["user", "modified"], index_name="user_modified_index")
@@ -3,3 +3,14 @@ from frappe.model.document import Document
 
 class AIScheduledReport(Document):
     pass
+
+
+def on_doctype_update():
+    """
+    Composite index for the hourly due scan: active is matched exactly, then
+    each frequency branch seeks a last_generated range instead of scanning.
+    """
+    frappe.db.add_index(
+        "AI Scheduled Report", ["active", "frequency", "last_generated"],
+        index_name="active_frequency_last_generated_index",
+    )
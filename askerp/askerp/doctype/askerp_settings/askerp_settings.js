@@ -45,6 +45,37 @@ frappe.ui.form.on("AskERP Settings", {
             );
         }, __("Actions"));
 
+        // Test All Models button — checks every enabled model's connectivity
+        frm.add_custom_button(__("Test All Models"), function () {
+            frappe.call({
+                method: "askerp.api.test_all_connections",
+                freeze: true,
+                freeze_message: __("Testing model connections..."),
+                callback: function (r) {
+                    var res = r && r.message;
+                    if (!res || !res.success) {
+                        frappe.msgprint((res && res.message) || __("Connection test failed."));
+                        return;
+                    }
+                    if (!res.results.length) {
+                        frappe.msgprint(__("No enabled models to test."));
+                        return;
+                    }
+                    var rows = res.results.map(function (t) {
+                        return '<tr><td>' + frappe.utils.escape_html(t.model) + '</td><td>' +
+                            (t.success ? '\u2705' : '\u274c') + '</td><td>' +
+                            frappe.utils.escape_html(t.message || '') + '</td></tr>';
+                    }).join('');
+                    frappe.msgprint({
+                        title: __("Model Connection Tests"),
+                        message: '<table class="table table-bordered"><tr><th>' + __("Model") +
+                            '</th><th></th><th>' + __("Result") + '</th></tr>' + rows + '</table>',
+                        wide: true
+                    });
+                }
+            });
+        }, __("Actions"));
+
         // Open Setup Wizard Now button (if incomplete)
         if (!frm.doc.setup_complete) {
             frm.add_custom_button(__("Open Setup Wizard"), function () {
@@ -35,29 +35,34 @@ def _check_access():
     return True
 
 
-@frappe.whitelist()
-def export_pdf(title, content, session_id=None):
-    """
-    Generate a PDF from AI chat content (markdown/HTML).
-
-    Args:
-        title (str): Report title
-        content (str): Markdown or HTML content from AI response
-        session_id (str): Chat session reference
-
-    Returns:
-        dict: {file_url, file_name}
-    """
-    _check_access()
-
-    from frappe.utils.pdf import get_pdf
-    import re
-
-    # Convert markdown-style tables to HTML tables
-    html_content = _markdown_to_html(content)
+# Options passed to wkhtmltopdf for every export
+_PDF_OPTIONS = {
+    "page-size": "A4",
+    "margin-top": "15mm",
+    "margin-right": "15mm",
+    "margin-bottom": "15mm",
+    "margin-left": "15mm",
+}
+# Content longer than this is rendered in batches of sections and the pages
+# merged, so wkhtmltopdf's peak memory tracks one batch, not the whole report
+_PDF_CHUNK_THRESHOLD = 200_000
+_PDF_SECTIONS_PER_CHUNK = 100
+
+
+def _pdf_document(title, html_content, header=True, footer=True):
+    """Wrap converted content in the styled export document."""
+    header_html = f"""<div class="header">
+            <span class="logo">{_escape_html(get_trading_name().upper())}</span>
+            <h1>{_escape_html(title)}</h1>
+            <div class="subtitle">
+                Generated by AskERP on {frappe.utils.format_datetime(frappe.utils.now_datetime(), "dd MMM yyyy, hh:mm a")}
+            </div>
+        </div>""" if header else ""
+    footer_html = """<div class="footer">
+            AskERP — AI-Generated Report
+        </div>""" if footer else ""
 
-    # Build styled HTML document
-    html = f"""
+    return f"""
     <!DOCTYPE html>
     <html>
     <head>
@@ -136,33 +141,67 @@ def export_pdf(title, content, session_id=None):
         </style>
     </head>
     <body>
-        <div class="header">
-            <span class="logo">{_escape_html(get_trading_name().upper())}</span>
-            <h1>{_escape_html(title)}</h1>
-            <div class="subtitle">
-                Generated by AskERP on {frappe.utils.format_datetime(frappe.utils.now_datetime(), "dd MMM yyyy, hh:mm a")}
-            </div>
-        </div>
+        {header_html}
 
         <div class="content">
             {html_content}
         </div>
 
-        <div class="footer">
-            AskERP — AI-Generated Report
-        </div>
+        {footer_html}
     </body>
     </html>
     """
 
-    # Generate PDF bytes
-    pdf_data = get_pdf(html, options={
-        "page-size": "A4",
-        "margin-top": "15mm",
-        "margin-right": "15mm",
-        "margin-bottom": "15mm",
-        "margin-left": "15mm",
-    })
+
+def _render_pdf_in_chunks(title, content, get_pdf):
+    """
+    Render very long content as consecutive PDFs of _PDF_SECTIONS_PER_CHUNK
+    blank-line-separated sections each (tables stay whole) and merge the
+    pages. The header goes on the first part, the footer on the last.
+    """
+    import io
+    from pypdf import PdfReader, PdfWriter
+
+    sections = content.split("\n\n")
+    starts = range(0, len(sections), _PDF_SECTIONS_PER_CHUNK)
+    writer = PdfWriter()
+    for start in starts:
+        chunk = "\n\n".join(sections[start:start + _PDF_SECTIONS_PER_CHUNK])
+        html = _pdf_document(
+            title, _markdown_to_html(chunk),
+            header=start == 0,
+            footer=start + _PDF_SECTIONS_PER_CHUNK >= len(sections),
+        )
+        writer.append(PdfReader(io.BytesIO(get_pdf(html, options=_PDF_OPTIONS))))
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+@frappe.whitelist()
+def export_pdf(title, content, session_id=None):
+    """
+    Generate a PDF from AI chat content (markdown/HTML).
+
+    Args:
+        title (str): Report title
+        content (str): Markdown or HTML content from AI response
+        session_id (str): Chat session reference
+
+    Returns:
+        dict: {file_url, file_name}
+    """
+    _check_access()
+
+    from frappe.utils.pdf import get_pdf
+
+    if len(content) <= _PDF_CHUNK_THRESHOLD:
+        # Convert markdown-style tables to HTML tables
+        html = _pdf_document(title, _markdown_to_html(content))
+        pdf_data = get_pdf(html, options=_PDF_OPTIONS)
+    else:
+        pdf_data = _render_pdf_in_chunks(title, content, get_pdf)
 
     # Save as Frappe file
     file_name = f"{get_report_filename_prefix()}_{frappe.utils.now_datetime().strftime('%Y%m%d_%H%M%S')}.pdf"
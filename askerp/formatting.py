@@ -209,6 +209,14 @@ def format_number(value, profile=None):
 
 # ─── Internal Formatters ─────────────────────────────────────────────────────
 
+# (threshold, divisor, format spec, suffix) — checked largest first
+_INDIAN_SCALES = (
+    (1_00_00_000, 1_00_00_000, ".2f", " Cr"),  # 1 Crore = 10 million
+    (1_00_000, 1_00_000, ".2f", " L"),  # 1 Lakh = 100 thousand
+    (1_000, 1, ",.0f", ""),
+)
+
+
 def _format_indian(value, symbol="₹"):
     """
     Format a number in Indian notation (Lakhs / Crores).
@@ -216,18 +224,15 @@ def _format_indian(value, symbol="₹"):
     """
     if value is None:
         return f"{symbol}0"
-    val = flt(value)
+    # Callers (format_currency/format_number) already pass a float
+    val = value if type(value) is float else flt(value)
     abs_val = abs(val)
     sign = "-" if val < 0 else ""
 
-    if abs_val >= 1_00_00_000:  # 1 Crore = 10 million
-        return f"{sign}{symbol}{abs_val / 1_00_00_000:.2f} Cr"
-    elif abs_val >= 1_00_000:  # 1 Lakh = 100 thousand
-        return f"{sign}{symbol}{abs_val / 1_00_000:.2f} L"
-    elif abs_val >= 1_000:
-        return f"{sign}{symbol}{abs_val:,.0f}"
-    else:
-        return f"{sign}{symbol}{abs_val:.2f}"
+    for threshold, divisor, spec, suffix in _INDIAN_SCALES:
+        if abs_val >= threshold:
+            return f"{sign}{symbol}{format(abs_val / divisor, spec)}{suffix}"
+    return f"{sign}{symbol}{abs_val:.2f}"
 
 
 def _format_international(value, symbol="$"):
@@ -21,6 +21,10 @@ after_install = "askerp.install.after_install"
 # Post-uninstall hook — removes custom fields, clears caches, cleans up
 after_uninstall = "askerp.uninstall.after_uninstall"
 
+# Post-migrate hook — drops cached tool results so every live entry is written
+# (and reverse-indexed) by the code now deployed
+after_migrate = ["askerp.query_cache.clear_all_cache"]
+
 # Boot session hook — injects setup_complete flag for wizard notification bar
 boot_session = "askerp.setup_wizard.boot_session"
 
@@ -43,7 +47,10 @@ override_whitelisted_methods = {}
 # Phase 6.1: Also clear query cache when core business data changes
 doc_events = {
     "AskERP Settings": {
-        "after_save": "askerp.classifier._reset_custom_patterns_cache",
+        "after_save": [
+            "askerp.classifier._reset_custom_patterns_cache",
+            "askerp.providers.clear_settings_cache",
+        ],
     },
     "AskERP Business Profile": {
         "after_save": "askerp.business_context.clear_profile_cache",
@@ -56,6 +63,17 @@ doc_events = {
         "after_save": "askerp.custom_tools.clear_custom_tool_cache",
         "after_delete": "askerp.custom_tools.clear_custom_tool_cache",
     },
+    "AskERP Model": {
+        "after_save": "askerp.providers.clear_api_key_cache",
+        "after_delete": "askerp.providers.clear_api_key_cache",
+    },
+    "User Permission": {
+        "after_save": "askerp.providers.clear_user_restricted_model_cache",
+        "after_delete": "askerp.providers.clear_user_restricted_model_cache",
+    },
+    "AI Usage Log": {
+        "after_insert": "askerp.providers.track_monthly_spend",
+    },
     # Phase 6.1: Invalidate AI query cache when business data changes
     "Sales Invoice": {
         "on_submit": "askerp.query_cache.clear_cache_for_doctype",
@@ -9,17 +9,93 @@ Run automatically via hooks.py after_install, or manually via bench console:
 """
 
 import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+from askerp.default_templates import (
+    EXECUTIVE_TEMPLATE,
+    MANAGEMENT_TEMPLATE,
+    FIELD_TEMPLATE,
+)
+from askerp.default_tools import DEFAULT_CUSTOM_TOOLS
+
+
+# Industry-agnostic Business Profile defaults, built once at import.
+# Applied only to fields the admin hasn't filled in yet.
+_PROFILE_DEFAULTS = {
+    "financial_year_start": "April",
+    "communication_style": "Professional",
+    "primary_language": "English",
+    "response_length": "Concise",
+    "ai_personality": (
+        "Professional but warm. Trusted senior executive, not a cold database. "
+        "Use 'we' and 'our'. Be decisive — don't hedge. Be proactive — if the "
+        "data shows something important, say it. Be concise — business users want "
+        "insights, not essays. Think ahead — anticipate what the user might ask "
+        "next. Challenge assumptions — if data contradicts what the user assumes, "
+        "respectfully point it out. Recommend actions — don't just report numbers."
+    ),
+    "example_voice": (
+        "Our collections this month are 38.4 L against 52.1 L in billing — "
+        "that's a 73.7% collection rate, down from 81.2% last month. DSO has "
+        "crept up to 47 days. I'd recommend focusing on the top 5 overdue "
+        "accounts — they hold 42% of outstanding. Want me to pull up the aging "
+        "breakdown?"
+    ),
+    "restricted_data": "\n".join((
+        "- Individual employee salaries (unless user has HR Manager role)",
+        "- Customer-specific pricing discounts",
+        "- Internal margin percentages (unless user is Executive/System Manager)",
+    )),
+    # Standard ERP terminology (universal)
+    "custom_terminology": "\n".join((
+        "SO = Sales Order",
+        "SI = Sales Invoice",
+        "DN = Delivery Note",
+        "PE = Payment Entry",
+        "PO = Purchase Order",
+        "PI = Purchase Invoice",
+        "PR = Purchase Receipt",
+        "WO = Work Order",
+        "SE = Stock Entry",
+        "GRN = Goods Receipt Note",
+        "BOM = Bill of Materials",
+        "DSO = Days Sales Outstanding",
+        "DPO = Days Payable Outstanding",
+        "DIO = Days Inventory Outstanding",
+        "MTD = Month To Date",
+        "YTD = Year To Date",
+        "QTD = Quarter To Date",
+        "SMLY = Same Month Last Year",
+    )),
+}
 
 
 def after_install():
-    """Main entry point called by hooks.py after app install."""
-    _create_custom_fields_on_user()
-    _create_default_models()
-    frappe.db.commit()  # Commit models so _create_default_settings can query them
-    _create_default_settings()
-    _create_default_business_profile()
-    _create_default_prompt_templates()
-    _create_default_custom_tools()
+    """
+    Main entry point called by hooks.py after app install.
+
+    All seed phases run in one transaction with a single commit at the end.
+    Later phases read earlier phases' rows on the same connection, so no
+    intermediate commit is needed — and a failure rolls back the seeded rows.
+    The User custom fields are the exception: their DDL on tabUser commits
+    implicitly, so they survive a rollback (re-running install is safe).
+
+    The phases deliberately run serially on this one connection. Profile,
+    templates and tools are independent of each other, but each is now a
+    couple of batched queries; running them on separate connections would
+    need per-thread frappe.init/connect and per-connection commits, which
+    costs more than it overlaps and breaks the single-transaction guarantee.
+    """
+    try:
+        _create_custom_fields_on_user()
+        model_by_id = _create_default_models()
+        _create_default_settings(model_by_id)
+        _create_default_business_profile()
+        _create_default_prompt_templates()
+        _create_default_custom_tools()
+    except Exception:
+        frappe.db.rollback()
+        raise
     frappe.db.commit()
     print("AskERP: Default models, settings, profile, templates, and custom tools created.")
 
@@ -35,8 +111,6 @@ def _create_custom_fields_on_user():
     - memory.py get_user_preferences() crashes on missing field
     - briefing scheduler job crashes when querying allow_ai_chat
     """
-    from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
-
     custom_fields = {
         "User": [
             {
@@ -58,6 +132,19 @@ def _create_custom_fields_on_user():
         ]
     }
 
+    # Re-installs: skip the meta walk entirely if both fields are already there
+    wanted = [f["fieldname"] for f in custom_fields["User"]]
+    existing = set(frappe.get_all(
+        "Custom Field",
+        filters={"dt": "User", "fieldname": ["in", wanted]},
+        pluck="fieldname",
+    ))
+    if existing.issuperset(wanted):
+        print("  Custom fields already exist on User doctype — skipping.")
+        return
+
+    custom_fields["User"] = [f for f in custom_fields["User"] if f["fieldname"] not in existing]
+    # create_custom_fields defers the User schema sync until all fields are in
     create_custom_fields(custom_fields, update=True)
     print("  Custom fields created on User doctype: allow_ai_chat, custom_ai_preferences")
 
@@ -66,6 +153,8 @@ def _create_default_models():
     """
     Create default AskERP Model records if they don't exist.
     Admin must still enter API keys — these are just the model configs.
+
+    Returns {model_id: name} for every enabled model, new or pre-existing.
     """
     models = [
         {
@@ -175,11 +264,18 @@ def _create_default_models():
         },
     ]
 
+    # One query for every existing model — reused by _create_default_settings
+    existing = {
+        m.model_id: m
+        for m in frappe.get_all("AskERP Model", fields=["name", "model_id", "enabled"])
+    }
+    model_by_id = {model_id: m.name for model_id, m in existing.items() if m.enabled}
+
     for model_data in models:
         rate_limits = model_data.pop("rate_limits", [])
 
         # Skip if model already exists
-        if frappe.db.exists("AskERP Model", {"model_id": model_data["model_id"]}):
+        if model_data["model_id"] in existing:
             continue
 
         doc = frappe.get_doc({
@@ -191,76 +287,67 @@ def _create_default_models():
             doc.append("rate_limits", rl)
 
         doc.insert(ignore_permissions=True)
+        if doc.enabled:
+            model_by_id[doc.model_id] = doc.name
         print(f"  Created model: {model_data['model_name']}")
 
+    return model_by_id
+
 
-def _create_default_settings():
+def _create_default_settings(model_by_id):
     """
     Create or update AskERP Settings with default tier assignments.
     Only sets values if they're empty — doesn't override admin changes.
-    """
-    try:
-        settings = frappe.get_doc("AskERP Settings")
-    except frappe.DoesNotExistError:
-        settings = frappe.get_doc({"doctype": "AskERP Settings"})
-        settings.insert(ignore_permissions=True)
 
-    changed = False
+    model_by_id is the {model_id: name} map of enabled models returned by
+    _create_default_models, so no model lookups happen here.
 
-    # Find model docs by model_id for tier assignment
-    def _get_model_name(model_id):
-        return frappe.db.get_value("AskERP Model", {"model_id": model_id, "enabled": 1}, "name")
+    Reads the singleton with get_singles_dict and writes only the changed
+    fields in one set_single_value call — no document load, no validation
+    pass, no rewrite of every tabSingles row. On a fresh install the
+    singleton has no rows yet: the full document is loaded and saved instead,
+    so the doctype's JSON defaults (query cache, priority queue, timeouts…)
+    are persisted alongside the tier and budget values.
+    """
+    current = frappe.db.get_singles_dict("AskERP Settings", cast=True)
+    settings = None
+    if not current:
+        # Once any row is written, Frappe stops applying the JSON defaults
+        settings = current = frappe.get_single("AskERP Settings")
+    updates = {}
+    _get_model_name = model_by_id.get
 
     # Only set tier defaults if not already configured
-    if not settings.tier_1_model:
+    tier_defaults = {
         # Tier 1 (Economy): Gemini Flash or Haiku
-        name = _get_model_name("gemini-2.0-flash") or _get_model_name("claude-haiku-4-5-20251001")
-        if name:
-            settings.tier_1_model = name
-            changed = True
-
-    if not settings.tier_2_model:
-        name = _get_model_name("claude-sonnet-4-5-20250929")
-        if name:
-            settings.tier_2_model = name
-            changed = True
-
-    if not settings.tier_3_model:
-        name = _get_model_name("claude-opus-4-5-20251101")
-        if name:
-            settings.tier_3_model = name
-            changed = True
-
-    if not settings.utility_model:
-        name = _get_model_name("claude-haiku-4-5-20251001")
-        if name:
-            settings.utility_model = name
-            changed = True
-
-    if not settings.vision_model:
-        name = _get_model_name("claude-sonnet-4-5-20250929") or _get_model_name("claude-opus-4-5-20251101")
-        if name:
-            settings.vision_model = name
-            changed = True
-
-    if not settings.fallback_model:
-        name = _get_model_name("claude-haiku-4-5-20251001")
+        "tier_1_model": ("gemini-2.0-flash", "claude-haiku-4-5-20251001"),
+        "tier_2_model": ("claude-sonnet-4-5-20250929",),
+        "tier_3_model": ("claude-opus-4-5-20251101",),
+        "utility_model": ("claude-haiku-4-5-20251001",),
+        "vision_model": ("claude-sonnet-4-5-20250929", "claude-opus-4-5-20251101"),
+        "fallback_model": ("claude-haiku-4-5-20251001",),
+    }
+    for fieldname, candidates in tier_defaults.items():
+        if current.get(fieldname):
+            continue
+        name = next(filter(None, map(_get_model_name, candidates)), None)
         if name:
-            settings.fallback_model = name
-            changed = True
+            updates[fieldname] = name
 
     # Set default cost control if not configured
-    if not settings.monthly_budget_limit:
-        settings.monthly_budget_limit = 100  # $100/month default
-        changed = True
+    if not current.get("monthly_budget_limit"):
+        updates["monthly_budget_limit"] = 100  # $100/month default
 
-    if not settings.enable_smart_routing:
-        settings.enable_smart_routing = 1
-        changed = True
+    if not current.get("enable_smart_routing"):
+        updates["enable_smart_routing"] = 1
 
-    if changed:
+    if settings is not None:
+        settings.update(updates)
         settings.save(ignore_permissions=True)
         print("  AskERP Settings defaults configured.")
+    elif updates:
+        frappe.db.set_single_value("AskERP Settings", updates)
+        print("  AskERP Settings defaults configured.")
     else:
         print("  AskERP Settings already configured — skipping.")
 
@@ -276,50 +363,38 @@ def _create_default_business_profile():
 
     Only sets values if the profile is empty — doesn't override user changes.
     """
-    try:
-        profile = frappe.get_single("AskERP Business Profile")
-        # Profile already exists — skip if admin already configured it
-        # Use 'industry' as sentinel: it's only set by setup wizard or manual config
-        if profile.industry and len(str(profile.industry).strip()) >= 3:
-            print("  AskERP Business Profile already configured — skipping.")
-            return
-    except frappe.DoesNotExistError:
-        # Brand new install — create minimal profile
-        profile = frappe.get_doc({
-            "doctype": "AskERP Business Profile",
-            "company_name": frappe.db.get_default("Company") or "My Company",
-        })
-        profile.insert(ignore_permissions=True)
-        profile = frappe.get_single("AskERP Business Profile")
+    # Skip if admin already configured it — one scalar read, no doc load.
+    # Use 'industry' as sentinel: it's only set by setup wizard or manual config
+    industry = frappe.db.get_single_value("AskERP Business Profile", "industry")
+    if industry and len(str(industry).strip()) >= 3:
+        print("  AskERP Business Profile already configured — skipping.")
+        return
+
+    profile = frappe.get_single("AskERP Business Profile")
+    default_company = frappe.db.get_default("Company") or ""
+    if not profile.company_name:
+        profile.company_name = default_company or "My Company"
 
     # ─── Auto-Detect from ERPNext ─────────────────────────────────────────
     # Pull what we can from the existing ERPNext setup so the admin has
     # less to fill in manually. Everything else is left blank for the
     # Setup Wizard or manual configuration.
 
-    default_company = frappe.db.get_default("Company") or ""
     if default_company:
         profile.company_name = default_company
 
-        # Try to detect currency from Company doctype
+        # Try to detect currency and country (for location) from Company doctype
         try:
-            company_currency = frappe.db.get_value(
-                "Company", default_company, "default_currency"
-            )
-            if company_currency:
-                profile.currency = company_currency
+            company = frappe.db.get_value(
+                "Company", default_company, ["default_currency", "country"],
+                as_dict=True,
+            ) or {}
+            if company.get("default_currency"):
+                profile.currency = company["default_currency"]
+            if company.get("country"):
+                profile.location = company["country"]
         except Exception:
-            profile.currency = "INR"
-
-        # Try to detect country for location
-        try:
-            company_country = frappe.db.get_value(
-                "Company", default_company, "country"
-            )
-            if company_country:
-                profile.location = company_country
-        except Exception:
-            pass
+            pass  # Left blank — the currency default below fills it in
 
     # ─── Sensible Defaults (industry-agnostic) ────────────────────────────
     # These provide a working baseline. The Setup Wizard will guide the
@@ -328,18 +403,6 @@ def _create_default_business_profile():
     if not profile.currency:
         profile.currency = "INR"
 
-    if not profile.financial_year_start:
-        profile.financial_year_start = "April"
-
-    if not profile.communication_style:
-        profile.communication_style = "Professional"
-
-    if not profile.primary_language:
-        profile.primary_language = "English"
-
-    if not profile.response_length:
-        profile.response_length = "Concise"
-
     if not profile.number_format:
         # Default based on currency
         currency = profile.currency or "INR"
@@ -348,54 +411,9 @@ def _create_default_business_profile():
         else:
             profile.number_format = "International (Thousands, Millions)"
 
-    if not profile.ai_personality:
-        profile.ai_personality = (
-            "Professional but warm. Trusted senior executive, not a cold database. "
-            "Use 'we' and 'our'. Be decisive — don't hedge. Be proactive — if the "
-            "data shows something important, say it. Be concise — business users want "
-            "insights, not essays. Think ahead — anticipate what the user might ask "
-            "next. Challenge assumptions — if data contradicts what the user assumes, "
-            "respectfully point it out. Recommend actions — don't just report numbers."
-        )
-
-    if not profile.example_voice:
-        profile.example_voice = (
-            "Our collections this month are 38.4 L against 52.1 L in billing — "
-            "that's a 73.7% collection rate, down from 81.2% last month. DSO has "
-            "crept up to 47 days. I'd recommend focusing on the top 5 overdue "
-            "accounts — they hold 42% of outstanding. Want me to pull up the aging "
-            "breakdown?"
-        )
-
-    if not profile.restricted_data:
-        profile.restricted_data = (
-            "- Individual employee salaries (unless user has HR Manager role)\n"
-            "- Customer-specific pricing discounts\n"
-            "- Internal margin percentages (unless user is Executive/System Manager)"
-        )
-
-    # ─── Standard ERP terminology (universal) ─────────────────────────────
-    if not profile.custom_terminology:
-        profile.custom_terminology = (
-            "SO = Sales Order\n"
-            "SI = Sales Invoice\n"
-            "DN = Delivery Note\n"
-            "PE = Payment Entry\n"
-            "PO = Purchase Order\n"
-            "PI = Purchase Invoice\n"
-            "PR = Purchase Receipt\n"
-            "WO = Work Order\n"
-            "SE = Stock Entry\n"
-            "GRN = Goods Receipt Note\n"
-            "BOM = Bill of Materials\n"
-            "DSO = Days Sales Outstanding\n"
-            "DPO = Days Payable Outstanding\n"
-            "DIO = Days Inventory Outstanding\n"
-            "MTD = Month To Date\n"
-            "YTD = Year To Date\n"
-            "QTD = Quarter To Date\n"
-            "SMLY = Same Month Last Year"
-        )
+    for fieldname, value in _PROFILE_DEFAULTS.items():
+        if not profile.get(fieldname):
+            profile.set(fieldname, value)
 
     profile.save(ignore_permissions=True)
     print("  AskERP Business Profile created with defaults. Complete setup via AskERP Setup Wizard.")
@@ -413,12 +431,6 @@ def _create_default_prompt_templates():
     Templates are created INACTIVE by default — the system falls back to the
     hardcoded prompts until an admin explicitly activates a template.
     """
-    from askerp.default_templates import (
-        EXECUTIVE_TEMPLATE,
-        MANAGEMENT_TEMPLATE,
-        FIELD_TEMPLATE,
-    )
-
     templates = [
         {
             "template_name": "Executive System Prompt",
@@ -455,19 +467,57 @@ def _create_default_prompt_templates():
         },
     ]
 
+    existing = set(frappe.get_all(
+        "AskERP Prompt Template",
+        filters={"name": ["in", [t["template_name"] for t in templates]]},
+        pluck="name",
+    ))
+
+    docs = []
     for tmpl in templates:
         # Skip if template already exists
-        if frappe.db.exists("AskERP Prompt Template", tmpl["template_name"]):
+        if tmpl["template_name"] in existing:
             print(f"  Template '{tmpl['template_name']}' already exists — skipping.")
             continue
 
         doc = frappe.get_doc({
             "doctype": "AskERP Prompt Template",
+            "name": tmpl["template_name"],
             **tmpl,
         })
-        doc.insert(ignore_permissions=True)
+        # Fill variables_used / stats / editor the same way a UI save would
+        doc.before_save()
+        docs.append(doc)
         print(f"  Created template: {tmpl['template_name']} ({tmpl['tier']} tier)")
 
+    _bulk_insert_docs(docs)
+
+
+def _bulk_insert_docs(docs):
+    """
+    Insert seed documents of one doctype with one INSERT per table —
+    all parents in one statement, all child rows of each child doctype
+    in another.
+
+    Skips the per-document insert machinery (naming, validation, hooks) —
+    only for trusted seed data whose name is already set on each doc.
+    """
+    now = frappe.utils.now()
+    user = frappe.session.user
+    tables = {}  # doctype → (fields, rows), parents first
+    for doc in docs:
+        for d in (doc, *doc.get_all_children()):
+            if d is not doc:
+                d.name = frappe.generate_hash(length=10)
+                d.parent = doc.name
+            d.update({"owner": user, "modified_by": user, "creation": now, "modified": now})
+            row = d.get_valid_dict(convert_dates_to_str=True)
+            fields, rows = tables.setdefault(d.doctype, (list(row), []))
+            rows.append([row.get(f) for f in fields])
+
+    for doctype, (fields, rows) in tables.items():
+        frappe.db.bulk_insert(doctype, fields, rows)
+
 
 def _create_default_custom_tools():
     """
@@ -478,27 +528,28 @@ def _create_default_custom_tools():
 
     Only creates tools if they don't already exist.
     """
-    from askerp.default_tools import DEFAULT_CUSTOM_TOOLS
+    existing = set(frappe.get_all("AskERP Custom Tool", pluck="name"))
 
+    docs = []
     for tool_data in DEFAULT_CUSTOM_TOOLS:
         # Skip if tool already exists
-        if frappe.db.exists("AskERP Custom Tool", tool_data["tool_name"]):
+        if tool_data["tool_name"] in existing:
             print(f"  Custom tool '{tool_data['tool_name']}' already exists — skipping.")
             continue
 
-        # Separate parameters from main doc fields
-        parameters = tool_data.pop("parameters", [])
+        # Separate parameters from main doc fields without mutating the shared dict
+        main_fields = {k: v for k, v in tool_data.items() if k != "parameters"}
 
         doc = frappe.get_doc({
             "doctype": "AskERP Custom Tool",
-            **tool_data,
+            "name": tool_data["tool_name"],
+            **main_fields,
         })
 
-        for param in parameters:
+        for param in tool_data.get("parameters", []):
             doc.append("parameters", param)
 
-        doc.insert(ignore_permissions=True)
+        docs.append(doc)
         print(f"  Created custom tool: {tool_data.get('display_name', tool_data.get('tool_name'))}")
 
-        # Re-add parameters key for future iterations (pop mutates the dict)
-        tool_data["parameters"] = parameters
+    _bulk_insert_docs(docs)
@@ -21,25 +21,71 @@ Memory layers:
 """
 
 import json
+import re
 import frappe
 from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+from itertools import compress
+
+try:
+    import orjson  # ships with Frappe v15
+except ImportError:
+    orjson = None
+
+
+def _loads(value):
+    """
+    Parse a JSON string; already-parsed values pass through unchanged.
+    Uses orjson when available. Its JSONDecodeError subclasses the stdlib
+    one, so callers keep catching json.JSONDecodeError.
+    """
+    if not isinstance(value, (str, bytes)):
+        return value
+    return orjson.loads(value) if orjson else json.loads(value)
+
+
+def _dumps(value):
+    """Serialize to a UTF-8 JSON string (non-ASCII kept as-is)."""
+    if orjson:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False)
 
 
 # ─── Session Summary Generation ──────────────────────────────────────────────
 
-def summarize_session(session_name):
+def _get_session_row(session_name):
+    """
+    Read just the memory-related columns of an AI Chat Session.
+    Avoids hydrating the full document. Returns an empty dict if missing.
+    """
+    return frappe.db.get_value(
+        "AI Chat Session", session_name,
+        ["user", "messages_json", "session_summary", "session_insights"],
+        as_dict=True,
+    ) or frappe._dict()
+
+
+_SUMMARIZER_SYSTEM_PROMPT = "You are a session summarizer. Return ONLY a 2-3 sentence summary."
+
+
+def summarize_session(session_name, commit=True, session=None):
     """
     Generate a 2-3 sentence summary of a chat session.
     Uses the utility model for speed and cost efficiency.
     Does NOT run if session has fewer than 2 user messages.
+
+    Pass commit=False to leave the write in the caller's transaction.
+    session: optional prefetched row with messages_json (skips the read).
     """
-    session = frappe.get_doc("AI Chat Session", session_name)
+    if session is None:
+        session = _get_session_row(session_name)
     messages_raw = session.get("messages_json")
     if not messages_raw:
         return None
 
     try:
-        messages = json.loads(messages_raw) if isinstance(messages_raw, str) else messages_raw
+        messages = _loads(messages_raw)
     except (json.JSONDecodeError, TypeError):
         return None
 
@@ -69,7 +115,7 @@ def summarize_session(session_name):
         result = call_model(
             utility_model,
             messages=[{"role": "user", "content": prompt}],
-            system_prompt="You are a session summarizer. Return ONLY a 2-3 sentence summary.",
+            system_prompt=_SUMMARIZER_SYSTEM_PROMPT,
             tools=None,
         )
 
@@ -82,7 +128,8 @@ def summarize_session(session_name):
             if summary:
                 frappe.db.set_value("AI Chat Session", session_name,
                                     "session_summary", summary, update_modified=False)
-                frappe.db.commit()
+                if commit:
+                    frappe.db.commit()
                 return summary
     except Exception as e:
         frappe.log_error(title="Memory: Session Summary Error", message=str(e))
@@ -114,8 +161,11 @@ Rules:
 - Return empty arrays [] for any category with no relevant items
 - Maximum 5 items per category"""
 
+# Markdown code-fence lines (```json / ```) some models wrap JSON in
+_FENCE_LINE_RE = re.compile(r"^[ \t]*```.*$", re.M)
+
 
-def extract_session_insights(session_name):
+def extract_session_insights(session_name, commit=True, session=None):
     """
     Extract structured insights from a completed chat session.
     Called automatically after session summarization.
@@ -127,14 +177,17 @@ def extract_session_insights(session_name):
     - follow_ups: unresolved items
 
     Returns the insights dict or None on failure.
+    Pass commit=False to leave the write in the caller's transaction.
+    session: optional prefetched row with messages_json and session_insights.
     """
-    session = frappe.get_doc("AI Chat Session", session_name)
+    if session is None:
+        session = _get_session_row(session_name)
 
     # Skip if already extracted
     existing = session.get("session_insights")
     if existing:
         try:
-            parsed = json.loads(existing) if isinstance(existing, str) else existing
+            parsed = _loads(existing)
             if parsed and any(parsed.get(k) for k in ("entities", "metrics_tracked", "patterns", "follow_ups")):
                 return parsed
         except (json.JSONDecodeError, TypeError):
@@ -145,7 +198,7 @@ def extract_session_insights(session_name):
         return None
 
     try:
-        messages = json.loads(messages_raw) if isinstance(messages_raw, str) else messages_raw
+        messages = _loads(messages_raw)
     except (json.JSONDecodeError, TypeError):
         return None
 
@@ -205,12 +258,10 @@ def extract_session_insights(session_name):
         # Parse JSON — handle cases where model wraps in ```json ... ```
         clean_text = response_text
         if clean_text.startswith("```"):
-            # Strip markdown code fences
-            lines = clean_text.split("\n")
-            lines = [l for l in lines if not l.strip().startswith("```")]
-            clean_text = "\n".join(lines)
+            # Strip markdown code fence lines in one regex pass
+            clean_text = _FENCE_LINE_RE.sub("", clean_text)
 
-        insights = json.loads(clean_text)
+        insights = _loads(clean_text)
 
         # Validate structure — ensure all expected keys exist with lists
         validated = {
@@ -221,10 +272,11 @@ def extract_session_insights(session_name):
         }
 
         # Store on the session record
-        insights_json = json.dumps(validated, ensure_ascii=False)
+        insights_json = _dumps(validated)
         frappe.db.set_value("AI Chat Session", session_name,
                             "session_insights", insights_json, update_modified=False)
-        frappe.db.commit()
+        if commit:
+            frappe.db.commit()
         return validated
 
     except json.JSONDecodeError:
@@ -251,11 +303,15 @@ def _clean_list(items, max_items=5):
 
 # ─── Cross-Session Insight Aggregation ───────────────────────────────────────
 
-def get_cross_session_insights(user, max_sessions=10):
+def get_cross_session_insights(user, max_sessions=10, sessions=None):
     """
     Aggregate insights from the user's recent sessions.
     Returns a formatted string suitable for injection into the system prompt.
 
+    sessions: optional prefetched AI Chat Session rows (name, modified,
+    session_insights), newest first — get_memory_context passes these so
+    the table is read once per memory build.
+
     Uses recency-weighted deduplication:
     - Recent sessions (last 3): weight 3x
     - Middle sessions (4-7): weight 2x
@@ -263,16 +319,19 @@ def get_cross_session_insights(user, max_sessions=10):
 
     Deduplicates entities and metrics using normalized matching.
     """
-    sessions = frappe.get_all(
-        "AI Chat Session",
-        filters={
-            "user": user,
-            "session_insights": ["is", "set"],
-        },
-        fields=["session_insights", "modified"],
-        order_by="modified desc",
-        limit=max_sessions,
-    )
+    if sessions is None:
+        sessions = frappe.get_all(
+            "AI Chat Session",
+            filters={
+                "user": user,
+                "session_insights": ["is", "set"],
+            },
+            fields=["name", "session_insights", "modified"],
+            order_by="modified desc",
+            limit=max_sessions,
+        )
+    else:
+        sessions = [s for s in sessions if s.session_insights][:max_sessions]
 
     if not sessions:
         return ""
@@ -283,29 +342,25 @@ def get_cross_session_insights(user, max_sessions=10):
     all_patterns = []
     all_follow_ups = []
 
-    for idx, s in enumerate(sessions):
-        try:
-            insights = json.loads(s.session_insights) if isinstance(s.session_insights, str) else s.session_insights
-        except (json.JSONDecodeError, TypeError):
-            continue
+    # Parsed insights per session (None if unparseable), reused for follow-ups below
+    parsed_sessions = [
+        _parse_insights_cached(s.name, str(s.modified), s.session_insights)
+        for s in sessions
+    ]
 
-        if not isinstance(insights, dict):
+    for idx, insights in enumerate(parsed_sessions):
+        if insights is None:
             continue
+        entities, metrics_tracked, patterns, follow_ups = insights
 
-        # Recency weight: first 3 sessions get 3x, next 4 get 2x, rest get 1x
-        weight = 3 if idx < 3 else (2 if idx < 7 else 1)
-
-        for entity in insights.get("entities", []):
-            entity_counter[_normalize_key(entity)] += weight
+        weight = _RECENCY_WEIGHTS[idx] if idx < len(_RECENCY_WEIGHTS) else 1
 
-        for metric in insights.get("metrics_tracked", []):
-            metric_counter[_normalize_key(metric)] += weight
+        # Counter.update adds — each distinct key gets this session's weight once
+        entity_counter.update({key: weight for key in map(_normalize_key, entities) if key})
+        metric_counter.update({key: weight for key in map(_normalize_key, metrics_tracked) if key})
 
-        for pattern in insights.get("patterns", []):
-            all_patterns.append(pattern)
-
-        for follow_up in insights.get("follow_ups", []):
-            all_follow_ups.append(follow_up)
+        all_patterns.extend(patterns)
+        all_follow_ups.extend(follow_ups)
 
     # Build the output sections
     parts = []
@@ -328,13 +383,9 @@ def get_cross_session_insights(user, max_sessions=10):
 
     # Recent follow-ups (only from last 3 sessions — older ones are stale)
     recent_follow_ups = []
-    for idx, s in enumerate(sessions[:3]):
-        try:
-            insights = json.loads(s.session_insights) if isinstance(s.session_insights, str) else s.session_insights
-            for fu in insights.get("follow_ups", []):
-                recent_follow_ups.append(fu)
-        except (json.JSONDecodeError, TypeError):
-            continue
+    for insights in parsed_sessions[:3]:
+        if insights is not None:
+            recent_follow_ups.extend(insights[3])
 
     unique_follow_ups = _deduplicate_strings(recent_follow_ups, max_items=3)
     if unique_follow_ups:
@@ -347,15 +398,49 @@ def get_cross_session_insights(user, max_sessions=10):
     return "\n".join(parts)
 
 
+# Recency weight by session position: first 3 get 3x, next 4 get 2x, rest 1x
+_RECENCY_WEIGHTS = (3, 3, 3, 2, 2, 2, 2, 1, 1, 1)
+
+# Near-duplicate detection for _deduplicate_strings
+_SHINGLE_SIZE = 4
+_DUPLICATE_COVERAGE = 0.8
+
+
+@lru_cache(maxsize=512)
+def _parse_insights_cached(session_name, modified, raw):
+    """
+    Parse a session_insights blob once per (session, modified) version.
+    Returns a read-only (entities, metrics_tracked, patterns, follow_ups)
+    tuple of tuples, or None if the blob isn't a valid insights object.
+    """
+    try:
+        insights = _loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+    if not isinstance(insights, dict):
+        return None
+
+    return tuple(
+        tuple(insights.get(key) or ())
+        for key in ("entities", "metrics_tracked", "patterns", "follow_ups")
+    )
+
+
 def _normalize_key(text):
-    """Normalize a string for deduplication (lowercase, strip whitespace)."""
-    return text.strip().lower() if isinstance(text, str) else ""
+    """Normalize a string for deduplication (casefold, strip whitespace)."""
+    return text.strip().casefold() if isinstance(text, str) else ""
 
 
 def _deduplicate_strings(strings, max_items=5):
     """
-    Deduplicate a list of strings by checking if one is a substring of another.
+    Deduplicate a list of strings, dropping near-duplicates of longer ones.
     Keeps the longer/more detailed version. Returns at most max_items.
+
+    Single pass over 4-character shingles: a candidate whose shingles are
+    more than 80% covered by already-kept strings is a duplicate (this
+    includes every substring of a kept string). Strings shorter than one
+    shingle fall back to exact normalized match.
     """
     if not strings:
         return []
@@ -363,19 +448,28 @@ def _deduplicate_strings(strings, max_items=5):
     # Sort by length descending so longer strings are preferred
     sorted_strings = sorted(set(strings), key=len, reverse=True)
     unique = []
+    kept_lowered = []  # normalized form of each kept string, computed once
+    kept_shingles = set()
 
     for s in sorted_strings:
-        s_lower = s.lower().strip()
+        s_lower = _normalize_key(s)
         if not s_lower:
             continue
-        # Check if this is a substring of any already-kept string
-        is_duplicate = False
-        for kept in unique:
-            if s_lower in kept.lower() or kept.lower() in s_lower:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            unique.append(s)
+
+        if len(s_lower) < _SHINGLE_SIZE:
+            if any(s_lower in kept for kept in kept_lowered):
+                continue
+        else:
+            shingles = {
+                s_lower[i:i + _SHINGLE_SIZE]
+                for i in range(len(s_lower) - _SHINGLE_SIZE + 1)
+            }
+            if len(shingles & kept_shingles) > _DUPLICATE_COVERAGE * len(shingles):
+                continue
+            kept_shingles |= shingles
+
+        unique.append(s)
+        kept_lowered.append(s_lower)
         if len(unique) >= max_items:
             break
 
@@ -384,6 +478,25 @@ def _deduplicate_strings(strings, max_items=5):
 
 # ─── Memory Retrieval ────────────────────────────────────────────────────────
 
+# Recent sessions read per memory build (covers summaries and insights)
+_MEMORY_SESSION_LIMIT = 10
+
+# Memory context changes only on session close or a preference write, both
+# of which invalidate explicitly — the TTL just bounds staleness otherwise.
+_MEMORY_CONTEXT_TTL = 90
+# Users with no memory at all are cached longer (negative cache)
+_EMPTY_MEMORY_CONTEXT_TTL = 300
+
+
+def _memory_cache_key(user):
+    return f"askerp_memory_context_{user}"
+
+
+def clear_memory_context_cache(user):
+    """Drop the cached memory context for a user (after new memory is written)."""
+    frappe.cache().delete_value(_memory_cache_key(user))
+
+
 def get_memory_context(user):
     """
     Get the full memory context to inject into the system prompt.
@@ -392,21 +505,44 @@ def get_memory_context(user):
     2. Cross-session insights (entities, metrics, patterns, follow-ups)
     3. User preferences
     4. Recurring topics
+
+    Cached per user for _MEMORY_CONTEXT_TTL seconds; an empty result is
+    cached as "__none__" for _EMPTY_MEMORY_CONTEXT_TTL so new users don't
+    pay for three empty queries every turn.
     """
+    cache_key = _memory_cache_key(user)
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached if cached != "__none__" else ""
+
+    context = _build_memory_context(user)
+    if context:
+        frappe.cache().set_value(cache_key, context, expires_in_sec=_MEMORY_CONTEXT_TTL)
+    else:
+        frappe.cache().set_value(cache_key, "__none__", expires_in_sec=_EMPTY_MEMORY_CONTEXT_TTL)
+    return context
+
+
+def _build_memory_context(user):
+    """Assemble the memory context from the database (uncached)."""
     parts = []
 
-    # 1. Recent session summaries (last 3 with summaries)
-    recent_summaries = frappe.get_all(
+    # One read of the user's recent sessions feeds both summaries and insights
+    sessions = frappe.get_all(
         "AI Chat Session",
-        filters={
-            "user": user,
+        filters={"user": user},
+        or_filters={
             "session_summary": ["is", "set"],
+            "session_insights": ["is", "set"],
         },
-        fields=["title", "session_summary", "modified"],
+        fields=["name", "title", "session_summary", "session_insights", "modified"],
         order_by="modified desc",
-        limit=3,
+        limit=_MEMORY_SESSION_LIMIT,
     )
 
+    # 1. Recent session summaries (last 3 with summaries)
+    recent_summaries = [s for s in sessions if s.session_summary][:3]
+
     if recent_summaries:
         summary_lines = []
         for s in recent_summaries:
@@ -415,7 +551,7 @@ def get_memory_context(user):
         parts.append("Recent conversation history:\n" + "\n".join(summary_lines))
 
     # 2. Cross-session insights (NEW in v3.0)
-    insights_text = get_cross_session_insights(user)
+    insights_text = get_cross_session_insights(user, sessions=sessions)
     if insights_text:
         parts.append("Cross-session intelligence:\n" + insights_text)
 
@@ -451,7 +587,7 @@ def get_user_preferences(user):
             return {}
         prefs_json = frappe.db.get_value("User", user, "custom_ai_preferences")
         if prefs_json:
-            return json.loads(prefs_json) if isinstance(prefs_json, str) else prefs_json
+            return _loads(prefs_json)
     except Exception:
         pass
     return {}
@@ -466,17 +602,44 @@ def save_user_preference(user, key, value):
         prefs = get_user_preferences(user)
         prefs[key] = value
 
-        frappe.db.set_value("User", user, "custom_ai_preferences",
-                            json.dumps(prefs, ensure_ascii=False), update_modified=False)
-        frappe.db.commit()
+        set_user_preferences(user, prefs)
         return True
     except Exception as e:
         frappe.log_error(title="Memory: Save Preference Error", message=str(e))
         return False
 
 
+def set_user_preferences(user, prefs):
+    """
+    Replace a user's stored preferences and commit.
+    Every writer of User.custom_ai_preferences goes through here, so the
+    cached memory context (which embeds the preferences) is always dropped.
+    """
+    frappe.db.set_value("User", user, "custom_ai_preferences",
+                        _dumps(prefs), update_modified=False)
+    frappe.db.commit()
+    clear_memory_context_cache(user)
+
+
 # ─── Recurring Topics ────────────────────────────────────────────────────────
 
+# Topic → keywords for recurring-topic detection. Plain substring match
+# (so "orders" hits "order"), compiled to one alternation per topic.
+_TOPIC_KEYWORDS = {
+    "sales": ["sales", "revenue", "order", "invoice", "customer"],
+    "collections": ["payment", "collection", "receivable", "outstanding", "dso"],
+    "purchase": ["purchase", "supplier", "vendor", "procurement"],
+    "inventory": ["stock", "inventory", "warehouse", "item", "bin"],
+    "finance": ["cash", "bank", "profit", "loss", "margin", "expense"],
+    "production": ["production", "manufacturing", "batch", "work order"],
+    "hr": ["employee", "attendance", "leave", "salary", "payroll"],
+}
+_TOPIC_PATTERNS = tuple(
+    (topic, re.compile("|".join(map(re.escape, keywords))))
+    for topic, keywords in _TOPIC_KEYWORDS.items()
+)
+
+
 def _get_recurring_topics(user):
     """
     Analyze recent queries to find recurring business topics with temporal decay.
@@ -502,39 +665,32 @@ def _get_recurring_topics(user):
         return []
 
     now = now_datetime()
+    last_week = now - timedelta(days=7)
+    last_month = now - timedelta(days=30)
 
-    topic_keywords = {
-        "sales": ["sales", "revenue", "order", "invoice", "customer"],
-        "collections": ["payment", "collection", "receivable", "outstanding", "dso"],
-        "purchase": ["purchase", "supplier", "vendor", "procurement"],
-        "inventory": ["stock", "inventory", "warehouse", "item", "bin"],
-        "finance": ["cash", "bank", "profit", "loss", "margin", "expense"],
-        "production": ["production", "manufacturing", "batch", "work order"],
-        "hr": ["employee", "attendance", "leave", "salary", "payroll"],
-    }
-
-    topic_scores = {topic: 0.0 for topic in topic_keywords}
-    total_weight = 0.0
-
+    # Column vectors: lowercased question and its temporal decay weight
+    questions = []
+    weights = []
     for log in recent:
         q = (log.question or "").lower()
         if not q:
             continue
-
-        # Calculate temporal decay weight
-        age_days = (now - log.creation).total_seconds() / 86400
-        if age_days <= 7:
-            weight = 3.0
-        elif age_days <= 30:
-            weight = 1.5
+        questions.append(q)
+        if log.creation >= last_week:
+            weights.append(3.0)
+        elif log.creation >= last_month:
+            weights.append(1.5)
         else:
-            weight = 0.5
+            weights.append(0.5)
 
-        total_weight += weight
+    total_weight = sum(weights)
 
-        for topic, keywords in topic_keywords.items():
-            if any(kw in q for kw in keywords):
-                topic_scores[topic] += weight
+    # Per topic: sum the weights of matching questions — map/compress/sum
+    # keep the per-question loop in C
+    topic_scores = {
+        topic: sum(compress(weights, map(pattern.search, questions)))
+        for topic, pattern in _TOPIC_PATTERNS
+    }
 
     if total_weight == 0:
         return []
@@ -556,17 +712,23 @@ def maybe_summarize_on_close(session_name):
     """
     Called when a session is archived/closed.
     Generates a summary AND extracts insights if the session has enough messages.
+    Each write is committed before the next AI call, so the session row
+    isn't held locked across the insight extraction's HTTP round-trip.
     """
     try:
-        session = frappe.get_doc("AI Chat Session", session_name)
+        session = _get_session_row(session_name)
 
         # Generate summary if not already done
         if not session.get("session_summary"):
-            summarize_session(session_name)
+            summarize_session(session_name, commit=False, session=session)
+            frappe.db.commit()
 
         # Extract insights if not already done (P2.3)
         if not session.get("session_insights"):
-            extract_session_insights(session_name)
+            extract_session_insights(session_name, commit=False, session=session)
+
+        frappe.db.commit()
+        clear_memory_context_cache(session.user)
 
     except Exception as e:
         frappe.log_error(title="Memory: Auto-Summary Error", message=str(e))
@@ -0,0 +1,9 @@
+import frappe
+
+
+def execute():
+    """
+    Add the (user, modified) index to existing sites. on_doctype_update only
+    runs when the DocType is synced, which migrate skips for an unchanged JSON.
+    """
+    frappe.db.add_index("AI Chat Session", ["user", "modified"], index_name="user_modified_index")
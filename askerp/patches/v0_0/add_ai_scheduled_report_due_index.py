@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+    """
+    Add the (active, frequency, last_generated) index used by the hourly due
+    scan to existing sites — on_doctype_update alone never reaches them.
+    """
+    frappe.db.add_index(
+        "AI Scheduled Report", ["active", "frequency", "last_generated"],
+        index_name="active_frequency_last_generated_index",
+    )
@@ -19,13 +19,17 @@ Dynamic filter tokens in filters_json:
 """
 
 import json
+import re
 import time
 import frappe
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from frappe.utils import (
     now_datetime, today, get_first_day, get_last_day,
     getdate, flt, fmt_money,
 )
-from askerp.formatting import format_currency, get_fy_dates
+from askerp.formatting import format_currency, get_cached_profile, get_fy_dates
 
 
 # ─── Token Replacement ──────────────────────────────────────────────────────
@@ -63,13 +67,17 @@ def _get_dynamic_tokens():
     }
 
 
+@lru_cache(maxsize=8)
+def _token_pattern(token_keys):
+    """Compile one alternation over the token names (keys never change per process)."""
+    return re.compile("|".join(map(re.escape, token_keys)))
+
+
 def _replace_tokens(text, tokens):
-    """Replace all dynamic tokens in a string."""
+    """Replace all dynamic tokens in a string in a single pass."""
     if not text:
         return text
-    for token, value in tokens.items():
-        text = text.replace(token, value)
-    return text
+    return _token_pattern(tuple(tokens)).sub(lambda m: tokens[m.group(0)], text)
 
 
 # ─── Metric Computation ────────────────────────────────────────────────────
@@ -131,6 +139,65 @@ def _compute_single_metric(metric, tokens):
         return None, str(e)[:500]
 
 
+# ─── Parallel Computation ──────────────────────────────────────────────────
+
+# Worker threads for refresh_cached_metrics — each holds its own DB connection
+_PRECOMPUTE_WORKERS = 4
+
+
+def _timed_compute(metric, tokens):
+    """Compute one metric. Returns (value, error, elapsed_ms, computed_at)."""
+    start_ns = time.perf_counter_ns()
+    value, error = _compute_single_metric(metric, tokens)
+    elapsed_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+    return value, error, elapsed_ms, now_datetime()
+
+
+def _compute_batch(site, sites_path, metrics, tokens):
+    """
+    Worker thread entry: compute a slice of metrics on a fresh site
+    connection. frappe.local is per-thread, so the worker must init,
+    connect (as Administrator) and tear down its own context.
+    """
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    try:
+        return {m.name: _timed_compute(m, tokens) for m in metrics}
+    finally:
+        frappe.destroy()
+
+
+def _compute_all_metrics(metrics, tokens):
+    """
+    Compute every metric, overlapping the DB round-trips across worker
+    threads. Returns {metric name: (value, error, elapsed_ms, computed_at)}.
+    Small metric sets run inline — a new connection costs more than it saves.
+    """
+    workers = min(_PRECOMPUTE_WORKERS, len(metrics) // 2)
+    if workers < 2:
+        return {m.name: _timed_compute(m, tokens) for m in metrics}
+
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+    batches = [metrics[i::workers] for i in range(workers)]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_compute_batch, site, sites_path, batch, tokens): batch
+            for batch in batches
+        }
+        for future, batch in futures.items():
+            try:
+                results.update(future.result())
+            except Exception as e:
+                # Worker couldn't connect — record the failure on each of its metrics
+                failed_at = now_datetime()
+                for m in batch:
+                    results[m.name] = (None, str(e)[:500], 0, failed_at)
+
+    return results
+
+
 # ─── Public API: Refresh All Metrics (Scheduler) ───────────────────────────
 
 def refresh_cached_metrics():
@@ -145,7 +212,10 @@ def refresh_cached_metrics():
         metrics = frappe.get_all(
             "AskERP Cached Metric",
             filters={"enabled": 1},
-            fields=["name"],
+            fields=[
+                "name", "query_type", "sql_query", "doctype_name",
+                "aggregation", "field_name", "filters_json",
+            ],
         )
     except Exception:
         # Doctype may not exist yet (fresh install, migration pending)
@@ -155,21 +225,20 @@ def refresh_cached_metrics():
         return
 
     tokens = _get_dynamic_tokens()
+    profile = get_cached_profile()  # one read for every metric's formatting
     computed = 0
     errors = 0
+    all_updates = {}
 
-    for m in metrics:
-        try:
-            metric = frappe.get_doc("AskERP Cached Metric", m.name)
-            start_ms = time.time()
-
-            value, error = _compute_single_metric(metric, tokens)
+    results = _compute_all_metrics(metrics, tokens)
 
-            elapsed_ms = int((time.time() - start_ms) * 1000)
+    for metric in metrics:
+        try:
+            value, error, elapsed_ms, computed_at = results[metric.name]
 
-            # Update the metric doc directly (bypass ORM for speed)
+            # Collected and written in one bulk_update below (bypass ORM for speed)
             updates = {
-                "last_computed": now_datetime(),
+                "last_computed": computed_at,
                 "computation_time_ms": elapsed_ms,
             }
 
@@ -178,19 +247,21 @@ def refresh_cached_metrics():
                 errors += 1
             else:
                 updates["cached_value"] = flt(value, 2)
-                updates["cached_value_formatted"] = format_currency(value)
+                updates["cached_value_formatted"] = format_currency(value, profile=profile)
                 updates["error_message"] = ""
                 computed += 1
 
-            frappe.db.set_value("AskERP Cached Metric", m.name, updates, update_modified=False)
+            all_updates[metric.name] = updates
 
         except Exception as e:
             errors += 1
             frappe.log_error(
-                title=f"Pre-compute Error: {m.name}",
+                title=f"Pre-compute Error: {metric.name}",
                 message=str(e),
             )
 
+    if all_updates:
+        frappe.db.bulk_update("AskERP Cached Metric", all_updates, update_modified=False)
     frappe.db.commit()
 
     if computed or errors:
@@ -233,13 +304,18 @@ def get_cached_metrics(category=None, company=None):
     except Exception:
         return []
 
+    # Profile is only needed for metrics missing a pre-formatted value
+    profile = None
+    if any(not m.cached_value_formatted for m in metrics):
+        profile = get_cached_profile()
+
     result = []
     for m in metrics:
         result.append({
             "metric_name": m.metric_name,
             "label": m.metric_label,
             "value": flt(m.cached_value),
-            "formatted": m.cached_value_formatted or format_currency(m.cached_value),
+            "formatted": m.cached_value_formatted or format_currency(m.cached_value, profile=profile),
             "category": m.category,
             "company": m.company,
             "last_computed": str(m.last_computed) if m.last_computed else None,
@@ -262,18 +338,13 @@ def get_metrics_for_prompt(company=None):
     if not metrics:
         return ""
 
-    # Group by category
-    by_category = {}
+    # Group by category (errored metrics are left out entirely)
+    by_category = defaultdict(list)
     for m in metrics:
-        cat = m["category"] or "Custom"
-        if cat not in by_category:
-            by_category[cat] = []
-        if not m.get("error"):
-            by_category[cat].append(f"{m['label']}: {m['formatted']}")
-
-    lines = []
-    for cat, items in sorted(by_category.items()):
-        if items:
-            lines.append(f"{cat} | {' | '.join(items)}")
-
-    return "\n".join(lines)
+        if m.get("error"):
+            continue
+        by_category[m["category"] or "Custom"].append(f"{m['label']}: {m['formatted']}")
+
+    return "\n".join(
+        f"{cat} | {' | '.join(items)}" for cat, items in sorted(by_category.items())
+    )
@@ -18,10 +18,138 @@ Usage:
 """
 
 import json
+import random
+import re
+import time
 import frappe
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 from askerp.formatting import get_role_sets
 
+try:
+    import orjson  # ships with Frappe v15
+except ImportError:
+    orjson = None
+
+
+# ─── Shared HTTP Session ────────────────────────────────────────────────────
+# One pooled session per worker process: repeat calls to the same provider
+# host reuse the open TLS connection instead of re-handshaking every time.
+# Retries stay in our own loops below, so the adapter never retries itself.
+# The layer stays synchronous: Frappe serves requests from sync workers, and
+# racing the fallback model against the primary would double-bill every turn.
+
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=0)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+_JSON_HEADERS = {"content-type": "application/json"}
+_json_loads = orjson.loads if orjson else json.loads  # orjson's JSONDecodeError is a ValueError too
+
+
+def _dump_body(payload):
+    """
+    Serialize a request payload to bytes, sent as data= instead of json=.
+    orjson encodes large prompts several times faster than the stdlib and
+    returns bytes directly; anything it rejects goes through json as before.
+    """
+    if orjson:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+
+# ─── Retry Policy ───────────────────────────────────────────────────────────
+# Shared by every provider: rate limits, transient 5xx/overload responses,
+# timeouts and dropped connections are retried with exponential backoff.
+# Random jitter keeps concurrent workers from retrying in lockstep.
+
+_MAX_RETRIES = 2
+_RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 529))
+_RETRY_BASE_DELAY = 2.0  # seconds; doubles per attempt
+_RETRY_MAX_DELAY = 30.0
+
+
+def _backoff(attempt):
+    """Sleep before retry number attempt + 1."""
+    time.sleep(min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * (2 ** attempt)) + random.random())
+
+
+def _post_with_retry(provider, model_id, url, body, headers, timeout, secret=None):
+    """
+    POST a pre-serialized body, retrying transient failures.
+
+    Returns the final response (which may still be an error status for the
+    caller to handle), or None when every attempt failed at the network
+    level. secret is redacted from logged errors (Gemini keys live in the URL).
+    """
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            resp = _SESSION.post(url, data=body, headers=headers, timeout=timeout)
+        except requests.exceptions.Timeout:
+            _log_api_error(provider, model_id, 0, f"{timeout}s timeout exceeded", attempt)
+        except requests.exceptions.ConnectionError as e:
+            detail = _exc_summary(e)
+            if secret:
+                detail = _sanitize_google_error(detail, secret)
+            _log_api_error(provider, model_id, 0, detail, attempt)
+        else:
+            if resp.status_code not in _RETRYABLE_STATUS or attempt == _MAX_RETRIES:
+                return resp
+            _log_api_error(provider, model_id, resp.status_code, resp.text[:500], attempt)
+
+        if attempt < _MAX_RETRIES:
+            _backoff(attempt)
+
+    return None
+
+
+def _error_result(provider, model_id, resp):
+    """Log a final non-200 response and turn it into a friendly normalized reply."""
+    _log_api_error(provider, model_id, resp.status_code, resp.text[:500], 0)
+    return _make_error_response(resp.status_code)
+
+
+# ─── API Key Cache ──────────────────────────────────────────────────────────
+# get_password() is a query on __Auth plus a decryption on every call.
+# Decrypted keys are held per worker process only (never in Redis), keyed
+# by site + model, and dropped when an AskERP Model is saved or deleted.
+
+_API_KEY_TTL = 300  # seconds — bounds staleness on other workers after a key change
+_api_key_cache = {}
+
+
+def _get_api_key(model_doc, fieldname="api_key"):
+    """Decrypted credential for a model, cached per process for _API_KEY_TTL."""
+    cache_key = (frappe.local.site, model_doc.name, fieldname)
+    cached = _api_key_cache.get(cache_key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    value = model_doc.get_password(fieldname)
+    if value:  # empty keys aren't cached, so a newly added key works at once
+        _api_key_cache[cache_key] = (value, time.monotonic() + _API_KEY_TTL)
+    return value
+
+
+def clear_api_key_cache(doc=None, method=None):
+    """
+    Drop cached credentials. Called by hooks.py doc_events when an
+    AskERP Model is saved or deleted, so key changes apply on this worker.
+    """
+    # Header dicts embed the plaintext key — drop them so rotated keys don't linger
+    _anthropic_headers.cache_clear()
+    if doc is None:
+        _api_key_cache.clear()
+        return
+    for cache_key in [k for k in _api_key_cache if k[1] == doc.name]:
+        _api_key_cache.pop(cache_key, None)
+
 
 # ─── Normalized Response Format ─────────────────────────────────────────────
 # All providers return this structure, regardless of their native API format.
@@ -33,6 +161,21 @@ from askerp.formatting import get_role_sets
 # }
 
 
+def _build_response(content, stop_reason, input_tokens=0, output_tokens=0,
+                    cache_read_tokens=0, cache_creation_tokens=0):
+    """Single builder for the normalized response dict used by every provider."""
+    return {
+        "content": content,
+        "stop_reason": stop_reason,
+        "usage": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cache_read_tokens,
+            "cache_creation_tokens": cache_creation_tokens,
+        },
+    }
+
+
 def call_model(model_doc, messages, system_prompt, tools=None, stream=False):
     """
     Unified model caller. Dispatches to the correct provider handler.
@@ -75,7 +218,7 @@ def call_model(model_doc, messages, system_prompt, tools=None, stream=False):
     except Exception as e:
         frappe.log_error(
             title=f"AI Provider Error: {provider}",
-            message=f"Model: {model_doc.model_id}\nError: {str(e)[:500]}"
+            message=f"Model: {model_doc.model_id}\nError: {_exc_summary(e, 500)}"
         )
         return None
 
@@ -84,109 +227,53 @@ def call_model(model_doc, messages, system_prompt, tools=None, stream=False):
 
 def _call_anthropic(model_doc, messages, system_prompt, tools=None):
     """Call Anthropic Claude API with prompt caching and adaptive thinking."""
-    api_key = model_doc.get_password("api_key")
+    api_key = _get_api_key(model_doc)
     if not api_key:
         frappe.log_error(title="Anthropic API Error", message=f"No API key for model {model_doc.model_id}")
         return None
 
     base_url = model_doc.api_base_url or "https://api.anthropic.com/v1/messages"
-    api_version = model_doc.api_version or "2023-06-01"
-    max_tokens = model_doc.max_output_tokens or 4096
+    payload = _build_anthropic_payload(model_doc, messages, system_prompt, tools)
+    headers = _anthropic_headers(api_key, model_doc.api_version or "2023-06-01")
+    body = _dump_body(payload)  # serialized once, reused across retries
 
-    # Build payload
-    payload = {
-        "model": model_doc.model_id,
-        "max_tokens": max_tokens,
-        "system": [
-            {
-                "type": "text",
-                "text": system_prompt,
-                "cache_control": {"type": "ephemeral"},
-            }
-        ],
-        "messages": messages,
-    }
+    timeout = get_tuning_value("api_timeout_seconds", 180)
 
-    # Extended thinking for models that support it
-    # Note: Opus 4.5 / Sonnet 4.5 require "type": "enabled" with budget_tokens.
-    # "type": "adaptive" is only supported on Opus 4.6+.
-    if model_doc.supports_thinking:
-        thinking_budget = min(max_tokens // 2, 8192)
-        payload["thinking"] = {"type": "enabled", "budget_tokens": thinking_budget}
-
-    # Tool definitions with cache control on last tool
-    if tools:
-        cached_tools = [t.copy() for t in tools]
-        if cached_tools:
-            cached_tools[-1] = {**cached_tools[-1], "cache_control": {"type": "ephemeral"}}
-        payload["tools"] = cached_tools
-
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": api_version,
-        "anthropic-beta": "prompt-caching-2024-07-31",
-        "content-type": "application/json",
-    }
-
-    # Retry logic
-    max_retries = 2
-    for attempt in range(max_retries + 1):
-        try:
-            resp = requests.post(base_url, json=payload, headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180))
-
-            if resp.status_code == 200:
-                data = resp.json()
-                return _normalize_anthropic_response(data)
-
-            # If thinking caused a 400 error, retry without it
-            if resp.status_code == 400 and "thinking" in payload:
-                error_text = resp.text[:500].lower()
-                if "thinking" in error_text or "adaptive" in error_text:
-                    frappe.log_error(
-                        title="Anthropic Thinking Fallback",
-                        message=f"Model {model_doc.model_id} doesn't support thinking. Retrying without it."
-                    )
-                    del payload["thinking"]
-                    resp = requests.post(base_url, json=payload, headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180))
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        return _normalize_anthropic_response(data)
-
-            # Credit exhaustion — don't retry, trigger fallback chain
-            if resp.status_code == 400:
-                err_body = resp.text[:500].lower()
-                if "credit balance" in err_body or "insufficient" in err_body:
-                    _handle_credit_exhaustion("Anthropic", model_doc.model_id, resp.text[:300])
-                    return None  # Caller (process_chat) handles tier downgrade
-
-            _log_api_error("Anthropic", model_doc.model_id, resp.status_code, resp.text[:500], attempt)
-
-            if resp.status_code in (429, 500, 502, 503, 529) and attempt < max_retries:
-                import time
-                time.sleep((attempt + 1) * 3)
-                continue
+    try:
+        resp = _post_with_retry("Anthropic", model_doc.model_id, base_url, body, headers, timeout)
+        if resp is None:
+            return None
 
-            return _make_error_response(resp.status_code)
+        if resp.status_code == 200:
+            return _normalize_anthropic_response(_json_loads(resp.content))
 
-        except requests.exceptions.Timeout:
-            _log_api_error("Anthropic", model_doc.model_id, 0, "180s timeout exceeded", attempt)
-            if attempt < max_retries:
-                import time
-                time.sleep(3)
-                continue
+        # If thinking caused a 400 error, retry without it
+        if resp.status_code == 400 and "thinking" in payload:
+            error_text = resp.text[:500].lower()
+            if "thinking" in error_text or "adaptive" in error_text:
+                frappe.log_error(
+                    title="Anthropic Thinking Fallback",
+                    message=f"Model {model_doc.model_id} doesn't support thinking. Retrying without it."
+                )
+                del payload["thinking"]
+                resp = _post_with_retry("Anthropic", model_doc.model_id, base_url, _dump_body(payload), headers, timeout)
+                if resp is None:
+                    return None
+                if resp.status_code == 200:
+                    return _normalize_anthropic_response(_json_loads(resp.content))
 
-        except requests.exceptions.ConnectionError as e:
-            _log_api_error("Anthropic", model_doc.model_id, 0, str(e)[:200], attempt)
-            if attempt < max_retries:
-                import time
-                time.sleep(3)
-                continue
+        # Credit exhaustion — don't retry, trigger fallback chain
+        if resp.status_code == 400:
+            err_body = resp.text[:500].lower()
+            if "credit balance" in err_body or "insufficient" in err_body:
+                _handle_credit_exhaustion("Anthropic", model_doc.model_id, resp.text[:300])
+                return None  # Caller (process_chat) handles tier downgrade
 
-        except Exception as e:
-            _log_api_error("Anthropic", model_doc.model_id, 0, str(e)[:200], attempt)
-            break
+        return _error_result("Anthropic", model_doc.model_id, resp)
 
-    return None
+    except Exception as e:
+        _log_api_error("Anthropic", model_doc.model_id, 0, _exc_summary(e), 0)
+        return None
 
 
 def _call_anthropic_stream(model_doc, messages, system_prompt, tools=None):
@@ -194,48 +281,16 @@ def _call_anthropic_stream(model_doc, messages, system_prompt, tools=None):
     Streaming call to Anthropic. Returns the raw requests.Response with stream=True.
     The caller (process_chat_stream) parses SSE events from this.
     """
-    api_key = model_doc.get_password("api_key")
+    api_key = _get_api_key(model_doc)
     if not api_key:
         return None
 
     base_url = model_doc.api_base_url or "https://api.anthropic.com/v1/messages"
-    api_version = model_doc.api_version or "2023-06-01"
-    max_tokens = model_doc.max_output_tokens or 4096
-
-    payload = {
-        "model": model_doc.model_id,
-        "max_tokens": max_tokens,
-        "stream": True,
-        "system": [
-            {
-                "type": "text",
-                "text": system_prompt,
-                "cache_control": {"type": "ephemeral"},
-            }
-        ],
-        "messages": messages,
-    }
-
-    # Extended thinking: use "enabled" with budget_tokens (not "adaptive")
-    if model_doc.supports_thinking:
-        thinking_budget = min(max_tokens // 2, 8192)
-        payload["thinking"] = {"type": "enabled", "budget_tokens": thinking_budget}
-
-    if tools:
-        cached_tools = [t.copy() for t in tools]
-        if cached_tools:
-            cached_tools[-1] = {**cached_tools[-1], "cache_control": {"type": "ephemeral"}}
-        payload["tools"] = cached_tools
-
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": api_version,
-        "anthropic-beta": "prompt-caching-2024-07-31",
-        "content-type": "application/json",
-    }
+    payload = _build_anthropic_payload(model_doc, messages, system_prompt, tools, stream=True)
+    headers = _anthropic_headers(api_key, model_doc.api_version or "2023-06-01")
 
     try:
-        resp = requests.post(base_url, json=payload, headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180), stream=True)
+        resp = _SESSION.post(base_url, data=_dump_body(payload), headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180), stream=True)
         if resp.status_code == 200:
             return resp  # Return raw response for SSE parsing
 
@@ -248,7 +303,7 @@ def _call_anthropic_stream(model_doc, messages, system_prompt, tools=None):
                     message=f"Model {model_doc.model_id} doesn't support thinking. Retrying without it."
                 )
                 del payload["thinking"]
-                resp = requests.post(base_url, json=payload, headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180), stream=True)
+                resp = _SESSION.post(base_url, data=_dump_body(payload), headers=headers, timeout=get_tuning_value("api_timeout_seconds", 180), stream=True)
                 if resp.status_code == 200:
                     return resp
 
@@ -262,29 +317,126 @@ def _call_anthropic_stream(model_doc, messages, system_prompt, tools=None):
         _log_api_error("Anthropic Stream", model_doc.model_id, resp.status_code, resp.text[:500], 0)
         return None
     except Exception as e:
-        _log_api_error("Anthropic Stream", model_doc.model_id, 0, str(e)[:200], 0)
+        _log_api_error("Anthropic Stream", model_doc.model_id, 0, _exc_summary(e), 0)
         return None
 
 
-def _normalize_anthropic_response(data):
-    """Normalize Anthropic response to common format."""
+def iter_anthropic_events(resp):
+    """
+    Yield parsed SSE event payloads (dicts) from a streaming response
+    returned by _call_anthropic_stream().
+
+    Chunks are read as they arrive (chunk_size=None), so text deltas aren't
+    held back waiting for a fixed-size read to fill. Bytes are consumed
+    line by line from a bytearray buffer: each line is scanned once and
+    removed from the front, so cost stays linear in the stream size however
+    the network splits it. Multi-line data fields are joined per the SSE
+    spec; "[DONE]" and unparseable events are skipped. The response is
+    closed when iteration ends, returning its connection to the pool.
+    """
+    buffer = bytearray()
+    data_lines = []
+    try:
+        for chunk in resp.iter_content(chunk_size=None):
+            buffer.extend(chunk)
+            while True:
+                newline = buffer.find(b"\n")
+                if newline < 0:
+                    break
+                line = bytes(buffer[:newline]).rstrip(b"\r")
+                del buffer[:newline + 1]
+
+                if line.startswith(b"data:"):
+                    data_lines.append(line[5:].lstrip(b" "))
+                elif not line and data_lines:
+                    # Blank line ends the event
+                    data = b"\n".join(data_lines)
+                    data_lines = []
+                    if data == b"[DONE]":
+                        return
+                    try:
+                        yield _json_loads(data)
+                    except ValueError:
+                        continue
+    finally:
+        resp.close()
+
+
+@lru_cache(maxsize=32)
+def _anthropic_headers(api_key, api_version):
+    """Request headers per key/version. Shared across calls — never mutate."""
     return {
-        "content": data.get("content", []),
-        "stop_reason": data.get("stop_reason", "end_turn"),
-        "usage": {
-            "input_tokens": data.get("usage", {}).get("input_tokens", 0),
-            "output_tokens": data.get("usage", {}).get("output_tokens", 0),
-            "cache_read_tokens": data.get("usage", {}).get("cache_read_input_tokens", 0),
-            "cache_creation_tokens": data.get("usage", {}).get("cache_creation_input_tokens", 0),
-        },
+        "x-api-key": api_key,
+        "anthropic-version": api_version,
+        "anthropic-beta": "prompt-caching-2024-07-31",
+        "content-type": "application/json",
     }
 
 
+# Sub-dicts that are identical on every request are built once and shared.
+# They only ever get serialized, never mutated (the thinking fallback deletes
+# the key from the per-request payload, not from the shared dict).
+_EPHEMERAL_CACHE = {"type": "ephemeral"}
+
+
+@lru_cache(maxsize=16)
+def _anthropic_thinking(budget_tokens):
+    return {"type": "enabled", "budget_tokens": budget_tokens}
+
+
+def _build_anthropic_payload(model_doc, messages, system_prompt, tools=None, stream=False):
+    """Messages API payload shared by the blocking and streaming calls."""
+    max_tokens = model_doc.max_output_tokens or 4096
+
+    payload = {
+        "model": model_doc.model_id,
+        "max_tokens": max_tokens,
+        "system": [
+            {
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": _EPHEMERAL_CACHE,
+            }
+        ],
+        "messages": messages,
+    }
+    if stream:
+        payload["stream"] = True
+
+    # Extended thinking for models that support it
+    # Note: Opus 4.5 / Sonnet 4.5 require "type": "enabled" with budget_tokens.
+    # "type": "adaptive" is only supported on Opus 4.6+.
+    if model_doc.supports_thinking:
+        payload["thinking"] = _anthropic_thinking(min(max_tokens // 2, 8192))
+
+    # Tool definitions with cache control on last tool — only that one is copied
+    if tools:
+        payload["tools"] = [*tools[:-1], {**tools[-1], "cache_control": _EPHEMERAL_CACHE}]
+
+    return payload
+
+
+def _normalize_anthropic_response(data):
+    """Normalize Anthropic response to common format."""
+    usage = data.get("usage") or {}
+    return _build_response(
+        data.get("content", []),
+        data.get("stop_reason", "end_turn"),
+        usage.get("input_tokens", 0),
+        usage.get("output_tokens", 0),
+        usage.get("cache_read_input_tokens", 0),
+        usage.get("cache_creation_input_tokens", 0),
+    )
+
+
 # ─── Google (Gemini) ────────────────────────────────────────────────────────
 
+_GEMINI_ROLES = {"assistant": "model"}  # everything else is sent as "user"
+
+
 def _call_google(model_doc, messages, system_prompt, tools=None):
     """Call Google Gemini API."""
-    api_key = model_doc.get_password("api_key")
+    api_key = _get_api_key(model_doc)
     if not api_key:
         frappe.log_error(title="Google API Error", message=f"No API key for model {model_doc.model_id}")
         return None
@@ -295,24 +447,25 @@ def _call_google(model_doc, messages, system_prompt, tools=None):
 
     # Convert messages to Gemini format
     # Gemini uses: {"contents": [{"role": "user/model", "parts": [{"text": "..."}]}]}
+    # The system prompt is placed at the head of the first message's parts.
+    pending_system = [{"text": f"[System instructions]: {system_prompt}\n\n"}] if system_prompt else []
     gemini_contents = []
+    append = gemini_contents.append
     for msg in messages:
-        role = "model" if msg.get("role") == "assistant" else "user"
         content = msg.get("content", "")
         if isinstance(content, str):
-            gemini_contents.append({"role": role, "parts": [{"text": content}]})
+            parts = [{"text": content}]
         elif isinstance(content, list):
             # Handle multimodal content
-            parts = []
-            for block in content:
-                if block.get("type") == "text":
-                    parts.append({"text": block["text"]})
-            if parts:
-                gemini_contents.append({"role": role, "parts": parts})
-
-    # Add system prompt as first user message if not in contents
-    if system_prompt and gemini_contents:
-        gemini_contents[0]["parts"].insert(0, {"text": f"[System instructions]: {system_prompt}\n\n"})
+            parts = [{"text": block["text"]} for block in content if block.get("type") == "text"]
+            if not parts:
+                continue
+        else:
+            continue
+        if pending_system:
+            parts = pending_system + parts
+            pending_system = None
+        append({"role": _GEMINI_ROLES.get(msg.get("role"), "user"), "parts": parts})
 
     payload = {
         "contents": gemini_contents,
@@ -329,17 +482,20 @@ def _call_google(model_doc, messages, system_prompt, tools=None):
             payload["tools"] = gemini_tools
 
     try:
-        resp = requests.post(url, json=payload, timeout=60)
+        resp = _post_with_retry(
+            "Google", model_doc.model_id, url, _dump_body(payload), _JSON_HEADERS, 60, secret=api_key
+        )
+        if resp is None:
+            return None
 
         if resp.status_code != 200:
-            _log_api_error("Google", model_doc.model_id, resp.status_code, resp.text[:500], 0)
-            return _make_error_response(resp.status_code)
+            return _error_result("Google", model_doc.model_id, resp)
 
-        data = resp.json()
+        data = _json_loads(resp.content)
         return _normalize_google_response(data)
 
     except Exception as e:
-        _log_api_error("Google", model_doc.model_id, 0, _sanitize_google_error(str(e), api_key), 0)
+        _log_api_error("Google", model_doc.model_id, 0, _sanitize_google_error(_exc_summary(e, 500), api_key), 0)
         return None
 
 
@@ -371,38 +527,39 @@ def _normalize_google_response(data):
         for tc in tool_calls:
             content.append({"type": "tool_use", "id": tc["id"], "name": tc["name"], "input": tc["input"]})
 
-    return {
-        "content": content,
-        "stop_reason": stop_reason,
-        "usage": {
-            "input_tokens": usage_meta.get("promptTokenCount", 0),
-            "output_tokens": usage_meta.get("candidatesTokenCount", 0),
-            "cache_read_tokens": 0,
-            "cache_creation_tokens": 0,
-        },
-    }
+    return _build_response(
+        content,
+        stop_reason,
+        usage_meta.get("promptTokenCount", 0),
+        usage_meta.get("candidatesTokenCount", 0),
+    )
 
 
 def _convert_tools_to_gemini(tools):
     """Convert Anthropic-format tool definitions to Gemini format."""
-    gemini_functions = []
-    for tool in tools:
-        if tool.get("name") and tool.get("input_schema"):
-            gemini_functions.append({
-                "name": tool["name"],
-                "description": tool.get("description", ""),
-                "parameters": tool["input_schema"],
-            })
+    gemini_functions = [
+        _converted_tool(tool, "gemini", _gemini_function)
+        for tool in tools
+        if tool.get("name") and tool.get("input_schema")
+    ]
     if gemini_functions:
         return [{"functionDeclarations": gemini_functions}]
     return None
 
 
+def _gemini_function(tool):
+    return {
+        "name": tool["name"],
+        "description": tool.get("description", ""),
+        "parameters": tool["input_schema"],
+    }
+
+
 # ─── OpenAI + Custom (OpenAI-compatible) ────────────────────────────────────
 
 def _call_openai(model_doc, messages, system_prompt, tools=None):
     """Call OpenAI or any OpenAI-compatible API."""
-    api_key = model_doc.get_password("api_key")
+    api_key = _get_api_key(model_doc)
     if not api_key:
         frappe.log_error(title="OpenAI API Error", message=f"No API key for model {model_doc.model_id}")
         return None
@@ -452,84 +609,107 @@ def _call_openai(model_doc, messages, system_prompt, tools=None):
     }
 
     # Add org header if api_secret contains org ID
-    api_secret = model_doc.get_password("api_secret")
+    api_secret = _get_api_key(model_doc, "api_secret")
     if api_secret:
         headers["OpenAI-Organization"] = api_secret
 
     try:
-        resp = requests.post(base_url, json=payload, headers=headers, timeout=120)
+        resp = _post_with_retry("OpenAI", model_doc.model_id, base_url, _dump_body(payload), headers, 120)
+        if resp is None:
+            return None
 
         if resp.status_code != 200:
-            _log_api_error("OpenAI", model_doc.model_id, resp.status_code, resp.text[:500], 0)
-            return _make_error_response(resp.status_code)
+            return _error_result("OpenAI", model_doc.model_id, resp)
 
-        data = resp.json()
+        data = _json_loads(resp.content)
         return _normalize_openai_response(data)
 
     except Exception as e:
-        _log_api_error("OpenAI", model_doc.model_id, 0, str(e)[:200], 0)
+        _log_api_error("OpenAI", model_doc.model_id, 0, _exc_summary(e), 0)
         return None
 
 
 def _normalize_openai_response(data):
     """Normalize OpenAI response to common format."""
     content = []
-    choices = data.get("choices", [])
-
-    if choices:
-        choice = choices[0]
-        message = choice.get("message", {})
-
-        # Text content
-        if message.get("content"):
-            content.append({"type": "text", "text": message["content"]})
-
-        # Tool calls
-        if message.get("tool_calls"):
-            for tc in message["tool_calls"]:
-                try:
-                    args = json.loads(tc["function"]["arguments"]) if isinstance(tc["function"]["arguments"], str) else tc["function"]["arguments"]
-                except (json.JSONDecodeError, KeyError):
-                    args = {}
-                content.append({
-                    "type": "tool_use",
-                    "id": tc.get("id", ""),
-                    "name": tc["function"]["name"],
-                    "input": args,
-                })
+    append = content.append
+    choices = data.get("choices")
+    choice = choices[0] if choices else {}
+    message = choice.get("message") or {}
+
+    # Text content
+    if message.get("content"):
+        append({"type": "text", "text": message["content"]})
+
+    # Tool calls
+    for tc in message.get("tool_calls") or ():
+        function = tc.get("function") or {}
+        try:
+            args = function["arguments"]
+            if isinstance(args, str):
+                args = _json_loads(args)
+        except (ValueError, KeyError):
+            args = {}
+        append({
+            "type": "tool_use",
+            "id": tc.get("id", ""),
+            "name": function["name"],
+            "input": args,
+        })
 
     # Determine stop reason
-    finish_reason = choices[0].get("finish_reason", "stop") if choices else "stop"
-    stop_reason = "tool_use" if finish_reason == "tool_calls" else "end_turn"
+    stop_reason = "tool_use" if choice.get("finish_reason", "stop") == "tool_calls" else "end_turn"
 
     usage = data.get("usage", {})
 
+    return _build_response(
+        content,
+        stop_reason,
+        usage.get("prompt_tokens", 0),
+        usage.get("completion_tokens", 0),
+    )
+
+
+def _convert_tools_to_openai(tools):
+    """Convert Anthropic-format tool definitions to OpenAI format."""
+    return [
+        _converted_tool(tool, "openai", _openai_function)
+        for tool in tools
+        if tool.get("name") and tool.get("input_schema")
+    ]
+
+
+def _openai_function(tool):
     return {
-        "content": content,
-        "stop_reason": stop_reason,
-        "usage": {
-            "input_tokens": usage.get("prompt_tokens", 0),
-            "output_tokens": usage.get("completion_tokens", 0),
-            "cache_read_tokens": 0,
-            "cache_creation_tokens": 0,
+        "type": "function",
+        "function": {
+            "name": tool["name"],
+            "description": tool.get("description", ""),
+            "parameters": tool["input_schema"],
         },
     }
 
 
-def _convert_tools_to_openai(tools):
-    """Convert Anthropic-format tool definitions to OpenAI format."""
-    oai_tools = []
-    for tool in tools:
-        if tool.get("name") and tool.get("input_schema"):
-            oai_tools.append({
-                "type": "function",
-                "function": {
-                    "name": tool["name"],
-                    "description": tool.get("description", ""),
-                    "parameters": tool["input_schema"],
-                },
-            })
-    return oai_tools
+# Converted definitions per source tool dict. The built-in ERPNext tools are
+# the same dict objects on every call, so each is converted once per process.
+# Entries hold the source dict itself: while cached, its id() can't be reused
+# by another object, so the identity check below is exact.
+_TOOL_CACHE_MAX = 256
+_tool_conversion_cache = {}
+
+
+def _converted_tool(tool, fmt, build):
+    """Return build(tool), reusing the result for the same tool dict object."""
+    key = (fmt, id(tool))
+    cached = _tool_conversion_cache.get(key)
+    if cached is not None and cached[0] is tool:
+        return cached[1]
+
+    converted = build(tool)
+    if len(_tool_conversion_cache) >= _TOOL_CACHE_MAX:
+        _tool_conversion_cache.clear()  # custom tools arrive as fresh dicts; don't grow forever
+    _tool_conversion_cache[key] = (tool, converted)
+    return converted
 
 
 # ─── Connection Testing ─────────────────────────────────────────────────────
@@ -537,15 +717,72 @@ def _convert_tools_to_openai(tools):
 def test_connection(model_doc):
     """
     Test connectivity to an AI model. Sends a minimal request.
-    Updates the model doc with test results.
+    Updates the model doc with test results (committed with the request).
 
     Returns:
         dict: {success: bool, message: str, latency_ms: float}
     """
-    import time
+    result, fields = _run_connection_test(model_doc)
+    if fields:
+        _save_test_results({model_doc.name: fields})
+    return result
+
+
+# Connection tests are network-bound and usually hit different hosts,
+# so a batch runs them side by side (GIL is released while waiting on sockets).
+_TEST_WORKERS = 8
 
+
+def test_connection_batch(model_docs):
+    """
+    Test several AI models concurrently and record every result in one UPDATE.
+
+    Returns:
+        list of result dicts in the same order as model_docs
+    """
+    if len(model_docs) < 2:
+        outcomes = [_run_connection_test(model_doc) for model_doc in model_docs]
+    else:
+        site, sites_path = frappe.local.site, frappe.local.sites_path
+        with ThreadPoolExecutor(max_workers=min(_TEST_WORKERS, len(model_docs))) as executor:
+            outcomes = list(executor.map(
+                lambda model_doc: _run_connection_test_in_thread(site, sites_path, model_doc),
+                model_docs,
+            ))
+
+    _save_test_results({
+        model_doc.name: fields
+        for model_doc, (_result, fields) in zip(model_docs, outcomes)
+        if fields
+    })
+    return [result for result, _fields in outcomes]
+
+
+def _run_connection_test_in_thread(site, sites_path, model_doc):
+    """
+    Worker thread entry: frappe.local is per-thread, so the worker opens its
+    own site connection (for get_password / timezone lookups) and closes it.
+    """
+    try:
+        frappe.init(site=site, sites_path=sites_path)
+        frappe.connect()
+    except Exception as e:
+        frappe.destroy()
+        return {"success": False, "message": f"Worker could not connect: {_exc_summary(e, 300)}", "latency_ms": 0}, None
+    try:
+        return _run_connection_test(model_doc)
+    finally:
+        frappe.destroy()
+
+
+def _run_connection_test(model_doc):
+    """
+    Run the provider's test request without touching the database.
+
+    Returns:
+        (result dict, AskERP Model field values to store — or None for an unknown provider)
+    """
     provider = (model_doc.provider or "").strip()
-    start = time.time()
 
     testers = {
         "Anthropic": _test_anthropic,
@@ -556,38 +793,44 @@ def test_connection(model_doc):
 
     tester = testers.get(provider)
     if not tester:
-        return {"success": False, "message": f"Unknown provider: {provider}", "latency_ms": 0}
+        return {"success": False, "message": f"Unknown provider: {provider}", "latency_ms": 0}, None
 
+    start = time.time()
     try:
         result = tester(model_doc)
-        latency = round((time.time() - start) * 1000, 1)
-        result["latency_ms"] = latency
-
-        # Update model doc with test results
-        now = frappe.utils.now_datetime().strftime("%Y-%m-%d %H:%M:%S")
-        status = "Pass" if result["success"] else "Fail"
-        message = result["message"]
-        if result["success"]:
-            message = f"Connected successfully in {latency}ms. {message}"
+    except Exception as e:
+        result = e
+    # One timestamp for either outcome; the DB driver formats the datetime itself
+    now = frappe.utils.now_datetime()
 
-        frappe.db.set_value("AskERP Model", model_doc.name, {
+    if isinstance(result, Exception):
+        return {"success": False, "message": _exc_summary(result, 500), "latency_ms": 0}, {
             "last_tested": now,
-            "test_status": status,
-            "test_message": message[:500],
-        }, update_modified=False)
-        frappe.db.commit()
+            "test_status": "Fail",
+            "test_message": f"Unexpected error: {_exc_summary(result, 400)}",
+        }
 
-        return result
+    latency = round((time.time() - start) * 1000, 1)
+    result["latency_ms"] = latency
 
-    except Exception as e:
-        now = frappe.utils.now_datetime().strftime("%Y-%m-%d %H:%M:%S")
-        frappe.db.set_value("AskERP Model", model_doc.name, {
-            "last_tested": now,
-            "test_status": "Fail",
-            "test_message": f"Unexpected error: {str(e)[:400]}",
-        }, update_modified=False)
-        frappe.db.commit()
-        return {"success": False, "message": str(e)[:500], "latency_ms": 0}
+    message = result["message"]
+    if result["success"]:
+        message = f"Connected successfully in {latency}ms. {message}"
+
+    return result, {
+        "last_tested": now,
+        "test_status": "Pass" if result["success"] else "Fail",
+        "test_message": message[:500],
+    }
+
+
+def _save_test_results(updates):
+    """
+    Write {model name: test fields} in a single bulk UPDATE. No explicit
+    commit — the surrounding web request or job commits on success.
+    """
+    if updates:
+        frappe.db.bulk_update("AskERP Model", updates, update_modified=False)
 
 
 def _test_anthropic(model_doc):
@@ -599,7 +842,7 @@ def _test_anthropic(model_doc):
     base_url = model_doc.api_base_url or "https://api.anthropic.com/v1/messages"
     api_version = model_doc.api_version or "2023-06-01"
 
-    resp = requests.post(
+    resp = _SESSION.post(
         base_url,
         headers={
             "x-api-key": api_key,
@@ -629,7 +872,7 @@ def _test_google(model_doc):
     base_url = model_doc.api_base_url or "https://generativelanguage.googleapis.com/v1beta/models"
     url = f"{base_url}/{model_doc.model_id}:generateContent?key={api_key}"
 
-    resp = requests.post(
+    resp = _SESSION.post(
         url,
         json={
             "contents": [{"parts": [{"text": "Say OK"}]}],
@@ -662,7 +905,7 @@ def _test_openai(model_doc):
     if api_secret:
         headers["OpenAI-Organization"] = api_secret
 
-    resp = requests.post(
+    resp = _SESSION.post(
         base_url,
         headers=headers,
         json={
@@ -692,6 +935,35 @@ def calculate_cost(model_doc, usage):
     Returns:
         dict: {cost_input, cost_output, cost_total}
     """
+    return _cost_for_usage(_model_rates(model_doc), usage)
+
+
+def calculate_cost_batch(model_doc, usages):
+    """
+    Cost many usage dicts against one model, e.g. when back-filling
+    AI Usage Log rows. Rates are resolved once for the whole batch.
+
+    Returns:
+        list of dicts in the same order, shaped like calculate_cost()
+    """
+    rates = _model_rates(model_doc)
+    return [_cost_for_usage(rates, usage) for usage in usages]
+
+
+def _model_rates(model_doc):
+    """Per-token rates (input, output, cache_read, cache_write) for a model."""
+    return (
+        float(model_doc.input_cost_per_million or 0) / 1_000_000,
+        float(model_doc.output_cost_per_million or 0) / 1_000_000,
+        float(model_doc.cache_read_cost_per_million or 0) / 1_000_000,
+        float(getattr(model_doc, "cache_write_cost_per_million", 0) or 0) / 1_000_000,
+    )
+
+
+def _cost_for_usage(rates, usage):
+    """Apply per-token rates from _model_rates() to one usage dict."""
+    input_rate, output_rate, cache_read_rate, cache_write_rate = rates
+
     input_tokens = max(0, usage.get("input_tokens", 0) or 0)
     output_tokens = max(0, usage.get("output_tokens", 0) or 0)
     cache_read_tokens = max(0, usage.get("cache_read_tokens", 0) or 0)
@@ -704,17 +976,12 @@ def calculate_cost(model_doc, usage):
     #   cache_creation = premium rate (typically 125% of input)
     regular_input_tokens = max(0, input_tokens - cache_read_tokens - cache_creation_tokens)
 
-    input_rate = float(model_doc.input_cost_per_million or 0)
-    output_rate = float(model_doc.output_cost_per_million or 0)
-    cache_read_rate = float(model_doc.cache_read_cost_per_million or 0)
-    cache_write_rate = float(getattr(model_doc, "cache_write_cost_per_million", 0) or 0)
-
     cost_input = (
-        (regular_input_tokens / 1_000_000) * input_rate
-        + (cache_read_tokens / 1_000_000) * cache_read_rate
-        + (cache_creation_tokens / 1_000_000) * cache_write_rate
+        regular_input_tokens * input_rate
+        + cache_read_tokens * cache_read_rate
+        + cache_creation_tokens * cache_write_rate
     )
-    cost_output = (output_tokens / 1_000_000) * output_rate
+    cost_output = output_tokens * output_rate
     cost_total = cost_input + cost_output
 
     return {
@@ -726,13 +993,36 @@ def calculate_cost(model_doc, usage):
 
 # ─── Model Resolution Helpers ───────────────────────────────────────────────
 
+# Settings are read several times per chat turn (tier, budget, limits,
+# tuning values). Each worker keeps the doc for _SETTINGS_TTL seconds so
+# those reads skip the Redis round-trip and document rebuild entirely.
+_SETTINGS_TTL = 10
+_settings_cache = {}
+
+
 def get_settings():
-    """Get the AskERP Settings singleton. Cached per request."""
+    """Get the AskERP Settings singleton. Cached per worker for _SETTINGS_TTL seconds."""
+    site = frappe.local.site
+    cached = _settings_cache.get(site)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
     try:
-        return frappe.get_cached_doc("AskERP Settings")
+        settings = frappe.get_cached_doc("AskERP Settings")
     except frappe.DoesNotExistError:
         return None
 
+    _settings_cache[site] = (settings, time.monotonic() + _SETTINGS_TTL)
+    return settings
+
+
+def clear_settings_cache(doc=None, method=None):
+    """
+    Drop this worker's cached settings. Called by hooks.py doc_events when
+    AskERP Settings is saved; other workers pick it up within _SETTINGS_TTL.
+    """
+    _settings_cache.pop(frappe.local.site, None)
+
 
 def get_tuning_value(field_name, default):
     """
@@ -795,34 +1085,49 @@ def get_model_for_tier(tier_name):
 def get_user_restricted_model(user):
     """
     Check if a user has a User Permission restricting them to a specific model.
+    The restriction (or its absence) is cached per user for 60s and cleared
+    when a User Permission is saved or deleted.
 
     Returns:
         AskERP Model doc if restricted, None if user can use any model
     """
-    perms = frappe.get_all(
-        "User Permission",
-        filters={
-            "user": user,
-            "allow": "AskERP Model",
-            "is_default": 0,
-        },
-        fields=["for_value"],
-        limit=1,
-    )
+    cache_key = f"askerp_user_restricted_model_{user}"
+    model_id = frappe.cache().get_value(cache_key)
+
+    if model_id is None:
+        rows = frappe.db.sql(
+            """
+            SELECT for_value FROM `tabUser Permission`
+            WHERE user = %s AND allow = 'AskERP Model' AND is_default = 0
+            LIMIT 1
+            """,
+            user,
+        )
+        model_id = (rows[0][0] if rows else None) or "__none__"
+        frappe.cache().set_value(cache_key, model_id, expires_in_sec=60)
 
-    if perms:
-        model_id = perms[0].get("for_value")
-        if model_id:
-            try:
-                model_doc = frappe.get_doc("AskERP Model", model_id)
-                if model_doc.enabled:
-                    return model_doc
-            except frappe.DoesNotExistError:
-                pass
+    if model_id == "__none__":
+        return None
+
+    try:
+        model_doc = frappe.get_cached_doc("AskERP Model", model_id)
+        if model_doc.enabled:
+            return model_doc
+    except frappe.DoesNotExistError:
+        pass
 
     return None
 
 
+def clear_user_restricted_model_cache(doc=None, method=None):
+    """
+    Clear the cached model restriction. Called by hooks.py doc_events
+    when a User Permission is saved or deleted.
+    """
+    if doc and doc.get("user"):
+        frappe.cache().delete_value(f"askerp_user_restricted_model_{doc.user}")
+
+
 def get_daily_limit_for_user(user, model_doc):
     """
     Get the daily query limit for a user on a specific model.
@@ -834,13 +1139,12 @@ def get_daily_limit_for_user(user, model_doc):
     if user == "Administrator":
         return 999
 
-    # Check model's rate_limits child table
+    # Check model's rate_limits child table (frappe.get_roles is served from Frappe's role cache)
     user_roles = set(frappe.get_roles(user))
-    max_limit = 0
-
-    for row in (model_doc.rate_limits or []):
-        if row.role in user_roles:
-            max_limit = max(max_limit, row.daily_limit or 0)
+    max_limit = max(
+        (row.daily_limit or 0 for row in (model_doc.rate_limits or []) if row.role in user_roles),
+        default=0,
+    )
 
     if max_limit > 0:
         return max_limit
@@ -852,14 +1156,82 @@ def get_daily_limit_for_user(user, model_doc):
 
     # Check if field staff (using dynamic role sets from AskERP Settings)
     role_sets = get_role_sets()
-    exec_mgmt_roles = role_sets["executive"] | role_sets["management"]
 
-    if not exec_mgmt_roles.intersection(user_roles):
+    if user_roles.isdisjoint(role_sets["executive"]) and user_roles.isdisjoint(role_sets["management"]):
         return settings.field_staff_daily_limit or 30
 
     return settings.default_daily_limit or 50
 
 
+# Month-to-date spend is a Redis float counter, seeded from SQL on a miss and
+# bumped by every AI Usage Log insert. The seed expires hourly, so rows that
+# skip the hook (or rolled-back inserts) are reconciled against SQL.
+_SPEND_RESYNC_SEC = 3600
+
+
+def _monthly_spend_key():
+    """Site-scoped Redis key for the current month's spend counter."""
+    return frappe.cache().make_key(f"askerp_monthly_spend:{frappe.utils.today()[:7]}")
+
+
+def _get_monthly_spend():
+    """Month-to-date cost_total across all AI Usage Log rows."""
+    cache = frappe.cache()
+    key = _monthly_spend_key()
+    try:
+        cached = cache.get(key)
+        if cached is not None:
+            return float(cached)
+    except Exception:
+        pass
+
+    first_day = frappe.utils.get_first_day(frappe.utils.today())
+    result = frappe.db.sql("""
+        SELECT COALESCE(SUM(cost_total), 0) as total_spend
+        FROM `tabAI Usage Log`
+        WHERE creation >= %s
+    """, first_day, as_dict=True)
+    current_spend = float(result[0].total_spend) if result else 0
+
+    try:
+        # nx: don't clobber a seed (plus increments) written by another worker
+        cache.set(key, current_spend, ex=_SPEND_RESYNC_SEC, nx=True)
+    except Exception:
+        pass
+
+    return current_spend
+
+
+# Bump the spend counter only if it is seeded, in one atomic step: a GET
+# then INCRBYFLOAT could recreate an expired key holding just one row's cost.
+# A key left without a TTL gets the resync expiry back.
+_SPEND_INCR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+    if redis.call('TTL', KEYS[1]) < 0 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 1
+end
+return 0
+"""
+
+
+def track_monthly_spend(doc, method=None):
+    """
+    Add a new AI Usage Log row's cost to the month's spend counter.
+    Called by hooks.py doc_events (after_insert). Only bumps a seeded
+    counter — an unseeded month is summed from SQL, which includes this row.
+    """
+    cost = float(doc.get("cost_total") or 0)
+    if cost <= 0:
+        return
+    try:
+        frappe.cache().eval(_SPEND_INCR_SCRIPT, 1, _monthly_spend_key(), cost, _SPEND_RESYNC_SEC)
+    except Exception:
+        pass
+
+
 def check_monthly_budget():
     """
     Check if the monthly budget limit has been exceeded.
@@ -872,18 +1244,7 @@ def check_monthly_budget():
         return False, 0, 0
 
     limit = float(settings.monthly_budget_limit)
-
-    # Sum cost_total for current month
-    from frappe.utils import get_first_day, get_last_day, today
-    first_day = get_first_day(today())
-
-    result = frappe.db.sql("""
-        SELECT COALESCE(SUM(cost_total), 0) as total_spend
-        FROM `tabAI Usage Log`
-        WHERE creation >= %s
-    """, first_day, as_dict=True)
-
-    current_spend = float(result[0].total_spend) if result else 0
+    current_spend = _get_monthly_spend()
 
     return current_spend >= limit, current_spend, limit
 
@@ -964,26 +1325,28 @@ def _notify_admin_credit_depletion(provider):
 
         frappe.db.commit()
     except Exception as e:
-        frappe.log_error(title="AskERP: Credit Notification Error", message=str(e)[:300])
+        frappe.log_error(title="AskERP: Credit Notification Error", message=_exc_summary(e, 300))
 
 
 # ─── Internal Helpers ────────────────────────────────────────────────────────
 
-def _make_error_response(status_code):
-    """Create a friendly error response instead of throwing."""
-    messages = {
-        429: "I'm getting a lot of requests right now. Please wait a moment and try again.",
-        401: "There's an issue with the AI service configuration. Please contact your admin.",
-        403: "Access to the AI service was denied. Please contact your admin.",
-        400: "I had trouble processing that request. Could you try rephrasing your question?",
-    }
-    error_msg = messages.get(status_code, "I'm having trouble connecting to my AI service right now. Please try again shortly.")
+_ERROR_MESSAGES = {
+    429: "I'm getting a lot of requests right now. Please wait a moment and try again.",
+    401: "There's an issue with the AI service configuration. Please contact your admin.",
+    403: "Access to the AI service was denied. Please contact your admin.",
+    400: "I had trouble processing that request. Could you try rephrasing your question?",
+}
+_DEFAULT_ERROR_MESSAGE = "I'm having trouble connecting to my AI service right now. Please try again shortly."
 
-    return {
-        "content": [{"type": "text", "text": error_msg}],
-        "stop_reason": "end_turn",
-        "usage": {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_creation_tokens": 0},
-    }
+
+def _make_error_response(status_code):
+    """
+    Create a friendly error response instead of throwing. Built fresh per
+    call: callers append the content to conversation history and serialize it,
+    so a shared (or read-only MappingProxyType) response isn't safe to return.
+    """
+    error_msg = _ERROR_MESSAGES.get(status_code, _DEFAULT_ERROR_MESSAGE)
+    return _build_response([{"type": "text", "text": error_msg}], "end_turn")
 
 
 def _sanitize_google_error(error_str, api_key):
@@ -991,10 +1354,20 @@ def _sanitize_google_error(error_str, api_key):
     if api_key and api_key in error_str:
         return error_str.replace(api_key, "***REDACTED***")
     # Also strip any ?key= parameter pattern
-    import re
     return re.sub(r'\?key=[A-Za-z0-9_-]+', '?key=***REDACTED***', error_str)
 
 
+def _exc_summary(e, limit=200):
+    """
+    "ExcType: args", truncated to limit characters. Formats the exception's
+    args directly instead of str(e) on wrapped urllib3/socket errors, and
+    keeps the exception type, which str(e) alone drops.
+    """
+    args = getattr(e, "args", ())
+    detail = args[0] if len(args) == 1 else (args or "")  # OSError is (errno, strerror)
+    return f"{type(e).__name__}: {detail!s:.{limit}}"
+
+
 def _log_api_error(provider, model_id, status_code, message, attempt):
     """Log an API error to Frappe Error Log."""
     frappe.log_error(
@@ -20,37 +20,99 @@ Configuration (AskERP Settings):
   - cache_max_entries: max entries before eviction (default 500)
 """
 
+import base64
 import json
 import hashlib
+import re
+import time
 import frappe
 from askerp.schema_utils import (
     resolve_known_doctypes_map,
     resolve_financial_doctypes,
-    resolve_core_doctypes,
 )
 
+try:
+    import orjson  # ships with Frappe v15
+except ImportError:
+    orjson = None
+
+# Match json.dumps(default=str): non-str keys allowed, datetimes via str()
+# ("2026-01-01 10:00:00", not orjson's ISO "T" form)
+_ORJSON_OPTS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+def _dumps(value, sort_keys=False):
+    """
+    Serialize to a UTF-8 JSON string (non-ASCII kept as-is), stringifying
+    dates and Decimals. Uses orjson when available; anything it rejects
+    (e.g. integers beyond 64 bits) goes through json instead.
+    """
+    if orjson:
+        try:
+            opts = _ORJSON_OPTS | orjson.OPT_SORT_KEYS if sort_keys else _ORJSON_OPTS
+            return orjson.dumps(value, default=str, option=opts).decode()
+        except TypeError:
+            pass
+    return json.dumps(value, default=str, sort_keys=sort_keys, ensure_ascii=False)
+
+
+def _loads(value):
+    """Parse a JSON string; already-parsed values pass through unchanged."""
+    if not isinstance(value, (str, bytes)):
+        return value
+    return orjson.loads(value) if orjson else json.loads(value)
+
 
 # Redis key prefix for all AI query cache entries
 _CACHE_PREFIX = "askerp_cache:"
-# Redis key for the cache index (tracks all active keys for eviction)
-_INDEX_KEY = "askerp_cache_index"
-# Redis keys for hit/miss counters (reset daily)
-_STATS_PREFIX = "askerp_cache_stats:"
+# Redis sorted set indexing all active keys for eviction (score = last write time)
+_INDEX_KEY = "askerp_cache_lru"
+# Pre-ZSET index (JSON list under a plain key) — only deleted now
+_LEGACY_INDEX_KEY = "askerp_cache_index"
+# On overflow, evict down to this fraction of cache_max_entries in one batch
+_EVICT_TO_RATIO = 0.9
+# Redis hash per day of hit/miss counters: fields "hit", "miss" (all tools)
+# and "hit:<tool>", "miss:<tool>". Bumped with HINCRBY, read with HGETALL.
+_STATS_PREFIX = "askerp_cache_daily:"
 _STATS_TTL = 86400 * 7  # 7 days of stats retention
-# Reverse index: doctype → set of cache keys for granular invalidation
-_DOCTYPE_INDEX_PREFIX = "askerp_cache_dt:"
+# Reverse index: doctype → Redis set of cache keys for granular invalidation
+# (the older JSON-list index under "askerp_cache_dt:" is left to expire)
+_DOCTYPE_INDEX_PREFIX = "askerp_cache_dtset:"
 
 
 def _get_settings():
-    """Get cache settings. Returns (enabled, ttl_seconds, max_entries)."""
+    """
+    Get cache settings. Returns (enabled, ttl_seconds, max_entries).
+    Memoized on frappe.local, so one request (or job) resolves them once
+    however many tool calls it probes; the next request reads them afresh.
+    """
+    memo = getattr(frappe.local, "askerp_query_cache_settings", None)
+    if memo is not None:
+        return memo
+
     try:
         settings = frappe.get_cached_doc("AskERP Settings")
         enabled = bool(settings.enable_query_cache)
         ttl = max(0, int(settings.cache_ttl_minutes or 15)) * 60  # Convert to seconds
         max_entries = max(10, int(settings.cache_max_entries or 500))
-        return enabled, ttl, max_entries
+        memo = (enabled, ttl, max_entries)
     except Exception:
-        return False, 900, 500  # Disabled by default if settings unavailable
+        memo = (False, 900, 500)  # Disabled by default if settings unavailable
+
+    frappe.local.askerp_query_cache_settings = memo
+    return memo
+
+
+def _index_members(start=0, end=-1):
+    """Cache keys in the LRU index, oldest first (ZRANGE by rank)."""
+    raw = frappe.cache.zrange(frappe.cache.make_key(_INDEX_KEY), start, end)
+    return [m.decode() if isinstance(m, bytes) else m for m in raw]
+
+
+def _index_remove(keys):
+    """Drop keys from the LRU index in one ZREM."""
+    if keys:
+        frappe.cache.zrem(frappe.cache.make_key(_INDEX_KEY), *keys)
 
 
 def _record_stat(stat_type, tool_name="global"):
@@ -61,42 +123,71 @@ def _record_stat(stat_type, tool_name="global"):
     """
     try:
         from frappe.utils import today
-        day = today()
-        # Global daily counter
-        global_key = f"{_STATS_PREFIX}{stat_type}:{day}"
-        val = frappe.cache.get_value(global_key)
-        frappe.cache.set_value(global_key, int(val or 0) + 1, expires_in_sec=_STATS_TTL)
-
-        # Per-tool daily counter
-        tool_key = f"{_STATS_PREFIX}{stat_type}:{day}:{tool_name}"
-        tval = frappe.cache.get_value(tool_key)
-        frappe.cache.set_value(tool_key, int(tval or 0) + 1, expires_in_sec=_STATS_TTL)
+        # Global and per-tool counters in the day's hash — one round-trip
+        day_key = _stats_key(today())
+        pipe = frappe.cache.pipeline(transaction=False)
+        pipe.hincrby(day_key, stat_type, 1)
+        pipe.hincrby(day_key, f"{stat_type}:{tool_name}", 1)
+        pipe.expire(day_key, _STATS_TTL)
+        pipe.execute()
     except Exception:
         pass  # Stats recording is best-effort
 
 
-def _get_daily_stat(stat_type, day, tool_name=None):
-    """Read a single stat counter."""
+def _stats_key(day):
+    """Site-scoped Redis key for one day's stats hash."""
+    return frappe.cache.make_key(f"{_STATS_PREFIX}{day}")
+
+
+def _stat_field(stat_type, tool_name=None):
+    """Hash field for a counter: "hit" overall, "hit:<tool>" per tool."""
+    return f"{stat_type}:{tool_name}" if tool_name else stat_type
+
+
+def _get_daily_stats(specs):
+    """
+    Read many stat counters with one HGETALL per distinct day, pipelined.
+    specs: list of (stat_type, day, tool_name) — returns ints in the same order.
+    """
     try:
-        if tool_name:
-            key = f"{_STATS_PREFIX}{stat_type}:{day}:{tool_name}"
-        else:
-            key = f"{_STATS_PREFIX}{stat_type}:{day}"
-        val = frappe.cache.get_value(key)
-        return int(val) if val else 0
+        days = list(dict.fromkeys(day for _stat, day, _tool in specs))
+        pipe = frappe.cache.pipeline(transaction=False)
+        for day in days:
+            pipe.hgetall(_stats_key(day))
+        hashes = {
+            day: {(k.decode() if isinstance(k, bytes) else k): v for k, v in raw.items()}
+            for day, raw in zip(days, pipe.execute())
+        }
+        return [
+            int(hashes[day].get(_stat_field(stat_type, tool_name)) or 0)
+            for stat_type, day, tool_name in specs
+        ]
     except Exception:
-        return 0
+        return [0] * len(specs)
+
+
+# Scalar value types that _make_cache_key can normalize without JSON
+_FLAT_TYPES = frozenset((str, int, float, bool, type(None)))
 
 
 def _make_cache_key(tool_name, tool_input):
     """
     Generate a deterministic cache key from tool name + input.
-    Uses SHA256 to keep keys short and avoid special characters.
+    Uses BLAKE2b (faster than SHA-256, no crypto strength needed here)
+    to keep keys short and avoid special characters.
     """
-    # Normalize the input by sorting keys for deterministic hashing
-    normalized = json.dumps({"tool": tool_name, "input": tool_input},
-                            sort_keys=True, default=str)
-    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:24]
+    if isinstance(tool_input, dict) and all(type(v) in _FLAT_TYPES for v in tool_input.values()):
+        # Fast path for flat inputs (the common case): repr() keeps 1, "1"
+        # and True distinct; the "flat|" prefix can't start a JSON dump.
+        normalized = "flat|" + tool_name + "|" + "|".join(
+            f"{k!r}={v!r}" for k, v in sorted(tool_input.items())
+        )
+    else:
+        # Normalize the input by sorting keys for deterministic hashing
+        normalized = _dumps({"tool": tool_name, "input": tool_input}, sort_keys=True)
+    # 96-bit digest as 16 URL-safe base64 chars (hex would take 24)
+    raw = hashlib.blake2b(normalized.encode("utf-8"), digest_size=12).digest()
+    digest = base64.urlsafe_b64encode(raw).decode()
     return f"{_CACHE_PREFIX}{tool_name}:{digest}"
 
 
@@ -116,6 +207,17 @@ _CACHEABLE_TOOLS = {
 }
 
 
+def _local_cache():
+    """
+    Per-request L1 in front of Redis: {cache key: result dict}.
+    Lives on frappe.local, so it is dropped with the request or job.
+    """
+    l1 = getattr(frappe.local, "askerp_query_cache_l1", None)
+    if l1 is None:
+        l1 = frappe.local.askerp_query_cache_l1 = {}
+    return l1
+
+
 def get_cached_result(tool_name, tool_input):
     """
     Check if a cached result exists for this tool call.
@@ -131,21 +233,82 @@ def get_cached_result(tool_name, tool_input):
         return None
 
     key = _make_cache_key(tool_name, tool_input)
+    l1 = _local_cache()
+    if key in l1:
+        _record_stat("hit", tool_name)
+        return dict(l1[key])  # shallow copy — callers may add keys
+
     try:
         cached = frappe.cache.get_value(key)
         if cached:
-            result = json.loads(cached) if isinstance(cached, str) else cached
+            result = _loads(cached)
             if isinstance(result, dict):
                 result["_from_cache"] = True
+                l1[key] = result
                 _record_stat("hit", tool_name)
-                return result
+                return dict(result)
     except Exception:
         pass  # Cache miss — proceed to execute
 
+    # The caller stores the result next with the same (tool_name, tool_input)
+    # objects; set_cached_result picks the key up instead of re-hashing
+    frappe.local.askerp_query_cache_miss = (tool_name, tool_input, key)
     _record_stat("miss", tool_name)
     return None
 
 
+# (known-doctypes map, scanners) — rebuilt when schema_utils hands out a new map
+_doctype_scanners = (None, None)
+
+
+def _compile_scanner(needles):
+    """
+    Compile {needle: {canonical, ...}} into one regex pass.
+    The alternation sits in a lookahead, so finditer tries every offset and
+    reports the longest needle starting there; `contains` maps that needle
+    to every needle inside it, so overlapping names (e.g. "sales invoice"
+    within "sales invoice item") are found just as a substring test would.
+    """
+    ordered = sorted(needles, key=len, reverse=True)
+    pattern = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+    contains = {
+        n: set().union(*(needles[o] for o in ordered if o in n))
+        for n in ordered
+    }
+    return pattern, contains
+
+
+def _get_doctype_scanners():
+    """
+    Scanners over the known-doctype map: plain lowercase names, and SQL
+    table names (`tab` + name with spaces removed). Compiled once per map;
+    schema_utils rebuilds the map on its TTL or after clear_schema_cache().
+    """
+    global _doctype_scanners
+    known = resolve_known_doctypes_map()
+    if _doctype_scanners[0] is not known:
+        scanners = None
+        if known:
+            names, tabs = {}, {}
+            for lower_name, canonical in known.items():
+                names.setdefault(lower_name, set()).add(canonical)
+                tabs.setdefault("tab" + lower_name.replace(" ", ""), set()).add(canonical)
+            scanners = (_compile_scanner(names), _compile_scanner(tabs))
+        _doctype_scanners = (known, scanners)
+    return _doctype_scanners[1]
+
+
+def _scan(scanner, text, found):
+    """Add every canonical doctype the scanner finds in text to found."""
+    pattern, contains = scanner
+    for m in pattern.finditer(text):
+        found |= contains[m.group(1)]
+
+
+# Tools whose inputs carry doctypes in free text (SQL) or imply a set of them
+_TEXT_SCAN_TOOLS = frozenset(("run_sql_query", "get_financial_summary", "compare_periods"))
+
+
 def _extract_doctypes_from_input(tool_name, tool_input):
     """
     Detect which ERPNext doctypes a tool call references.
@@ -156,23 +319,25 @@ def _extract_doctypes_from_input(tool_name, tool_input):
     if not tool_input:
         return doctypes
 
-    input_str = json.dumps(tool_input, default=str).lower() if isinstance(tool_input, dict) else str(tool_input).lower()
-
-    # Dynamic doctype map — resolved at runtime from live ERPNext metadata
-    _KNOWN_DOCTYPES = resolve_known_doctypes_map()
+    # Structured tools name their doctype outright — no need to scan the input
+    if isinstance(tool_input, dict) and tool_name not in _TEXT_SCAN_TOOLS:
+        dt = tool_input.get("doctype")
+        if dt and isinstance(dt, str):
+            doctypes.add(resolve_known_doctypes_map().get(dt.lower(), dt))
+            return doctypes
 
-    for lower_name, canonical in _KNOWN_DOCTYPES.items():
-        # Check in both tool_input text and SQL table references (tab prefix)
-        if lower_name in input_str or f"tab{canonical}".lower().replace(" ", "") in input_str.replace(" ", ""):
-            doctypes.add(canonical)
+    # Non-ASCII stays verbatim in the dump, so SQL in it reads as written
+    input_str = _dumps(tool_input).lower() if isinstance(tool_input, dict) else str(tool_input).lower()
 
-    # For SQL queries, also check `tabXxx` patterns
-    if tool_name == "run_sql_query" and isinstance(tool_input, dict):
-        sql = (tool_input.get("query") or tool_input.get("sql") or "").lower()
-        for lower_name, canonical in _KNOWN_DOCTYPES.items():
-            tab_name = f"`tab{canonical}`".lower()
-            if tab_name in sql:
-                doctypes.add(canonical)
+    # Dynamic doctype map — resolved at runtime from live ERPNext metadata
+    scanners = _get_doctype_scanners()
+    if scanners:
+        name_scanner, tab_scanner = scanners
+        # Plain names — this also covers `tabXxx` references in SQL queries,
+        # since every table name contains its doctype name
+        _scan(name_scanner, input_str, doctypes)
+        # SQL table references written without spaces (tabSalesInvoice)
+        _scan(tab_scanner, input_str.replace(" ", ""), doctypes)
 
     # Financial summary / compare_periods reference dynamic doctype sets
     fin = resolve_financial_doctypes()
@@ -192,26 +357,27 @@ def _extract_doctypes_from_input(tool_name, tool_input):
 
 def _update_doctype_index(cache_key, doctypes, ttl):
     """
-    Maintain reverse index: for each doctype, store the set of cache keys
+    Maintain reverse index: for each doctype, a Redis set of the cache keys
     that reference it. This enables granular invalidation.
+    One pipelined SADD + EXPIRE per doctype — no read-modify-write.
     """
-    for dt in doctypes:
-        dt_key = f"{_DOCTYPE_INDEX_PREFIX}{dt}"
-        try:
-            raw = frappe.cache.get_value(dt_key)
-            keys = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
-            if cache_key not in keys:
-                keys.append(cache_key)
-            frappe.cache.set_value(dt_key, json.dumps(keys), expires_in_sec=ttl + 60)
-        except Exception:
-            pass
+    try:
+        pipe = frappe.cache.pipeline(transaction=False)
+        for dt in doctypes:
+            dt_key = frappe.cache.make_key(f"{_DOCTYPE_INDEX_PREFIX}{dt}")
+            pipe.sadd(dt_key, cache_key)
+            pipe.expire(dt_key, ttl + 60)
+        pipe.execute()
+    except Exception:
+        pass
 
 
-def set_cached_result(tool_name, tool_input, result):
+def set_cached_result(tool_name, tool_input, result, result_json=None):
     """
     Cache a tool result in Redis with the configured TTL.
     Manages the cache index for LRU eviction and doctype reverse index
     for granular invalidation.
+    result_json: the result already encoded by the caller, stored as-is.
     """
     if tool_name in _UNCACHEABLE_TOOLS:
         return
@@ -227,10 +393,19 @@ def set_cached_result(tool_name, tool_input, result):
     if not enabled or ttl <= 0:
         return
 
-    key = _make_cache_key(tool_name, tool_input)
+    miss = getattr(frappe.local, "askerp_query_cache_miss", None)
+    if miss and miss[0] == tool_name and miss[1] is tool_input:
+        key = miss[2]
+    else:
+        key = _make_cache_key(tool_name, tool_input)
+    frappe.local.askerp_query_cache_miss = None
+
     try:
         # Store the result
-        frappe.cache.set_value(key, json.dumps(result, default=str), expires_in_sec=ttl)
+        if result_json is None:
+            result_json = _dumps(result)
+        frappe.cache.set_value(key, result_json, expires_in_sec=ttl)
+        _local_cache()[key] = {**result, "_from_cache": True}
 
         # Update cache index (simple list of active keys)
         _update_index(key, max_entries)
@@ -246,28 +421,26 @@ def set_cached_result(tool_name, tool_input, result):
 
 def _update_index(new_key, max_entries):
     """
-    Maintain a bounded index of cached keys.
-    Evicts oldest entries when max_entries is exceeded.
+    Maintain a bounded index of cached keys in a Redis sorted set.
+    ZADD re-scores an existing key (moves it to most recent) in O(log N).
+    Once max_entries is exceeded, the oldest entries are evicted in a batch
+    down to _EVICT_TO_RATIO of the limit, so a full cache pays for eviction
+    once per batch of writes instead of on every write. ZPOPMIN takes them
+    off the index atomically, so concurrent writers never evict the same keys.
     """
     try:
-        raw = frappe.cache.get_value(_INDEX_KEY)
-        index = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
-
-        # Remove this key if it already exists (move to end = most recent)
-        if new_key in index:
-            index.remove(new_key)
-        index.append(new_key)
-
-        # Evict oldest entries if over limit
-        while len(index) > max_entries:
-            old_key = index.pop(0)
-            try:
-                frappe.cache.delete_value(old_key)
-            except Exception:
-                pass
-
-        # Save updated index (no TTL — lives as long as the cache has entries)
-        frappe.cache.set_value(_INDEX_KEY, json.dumps(index))
+        index_key = frappe.cache.make_key(_INDEX_KEY)
+        pipe = frappe.cache.pipeline(transaction=False)
+        pipe.zadd(index_key, {new_key: time.time()})
+        pipe.zcard(index_key)
+        _added, size = pipe.execute()
+
+        # Evict oldest entries if over limit (one DEL for all of them)
+        if size > max_entries:
+            popped = frappe.cache.zpopmin(index_key, size - int(max_entries * _EVICT_TO_RATIO))
+            evicted = [m.decode() if isinstance(m, bytes) else m for m, _score in popped]
+            if evicted:
+                frappe.cache.delete_value(evicted)
     except Exception:
         pass  # Index maintenance is best-effort
 
@@ -278,13 +451,10 @@ def get_cache_stats():
     Returns: {total_entries, index_size}
     """
     try:
-        raw = frappe.cache.get_value(_INDEX_KEY)
-        index = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
+        index = _index_members()
 
-        alive = 0
-        for key in index:
-            if frappe.cache.get_value(key) is not None:
-                alive += 1
+        # One EXISTS over every indexed key returns how many are still live
+        alive = frappe.cache.exists(*index) if index else 0
 
         return {
             "total_entries": alive,
@@ -312,19 +482,26 @@ def get_cache_dashboard(days=7):
     enabled, ttl, max_entries = _get_settings()
     basic = get_cache_stats()
 
-    # ── Today's stats ────────────────────────────────────────────────────
+    # ── One pipelined read for every counter the dashboard shows ───────
     today_date = today_str()
-    today_hits = _get_daily_stat("hit", today_date)
-    today_misses = _get_daily_stat("miss", today_date)
+    days_list = [str(add_days(getdate(today_date), -i)) for i in range(days - 1, -1, -1)]
+    tools = sorted(_CACHEABLE_TOOLS)
+    specs = [(stat, today_date, None) for stat in ("hit", "miss")]
+    specs += [(stat, day, None) for day in days_list for stat in ("hit", "miss")]
+    specs += [(stat, today_date, tool) for tool in tools for stat in ("hit", "miss")]
+    counts = iter(_get_daily_stats(specs))
+
+    # ── Today's stats ────────────────────────────────────────────────────
+    today_hits = next(counts)
+    today_misses = next(counts)
     today_total = today_hits + today_misses
     today_rate = round((today_hits / today_total * 100), 1) if today_total > 0 else 0.0
 
     # ── Daily trend (last N days) ────────────────────────────────────────
     daily_trend = []
-    for i in range(days - 1, -1, -1):
-        day = str(add_days(getdate(today_date), -i))
-        h = _get_daily_stat("hit", day)
-        m = _get_daily_stat("miss", day)
+    for day in days_list:
+        h = next(counts)
+        m = next(counts)
         t = h + m
         rate = round((h / t * 100), 1) if t > 0 else 0.0
         daily_trend.append({
@@ -337,9 +514,9 @@ def get_cache_dashboard(days=7):
 
     # ── Per-tool breakdown (today only) ──────────────────────────────────
     by_tool = []
-    for tool in sorted(_CACHEABLE_TOOLS):
-        h = _get_daily_stat("hit", today_date, tool)
-        m = _get_daily_stat("miss", today_date, tool)
+    for tool in tools:
+        h = next(counts)
+        m = next(counts)
         t = h + m
         if t > 0:
             rate = round((h / t * 100), 1)
@@ -408,16 +585,11 @@ def clear_all_cache():
     - Data-changing doctypes are saved (configurable)
     """
     try:
-        raw = frappe.cache.get_value(_INDEX_KEY)
-        index = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
+        index = _index_members()
 
-        for key in index:
-            try:
-                frappe.cache.delete_value(key)
-            except Exception:
-                pass
-
-        frappe.cache.delete_value(_INDEX_KEY)
+        # delete_value takes a list and sends a single DEL for all keys
+        frappe.cache.delete_value(index + [_INDEX_KEY, _LEGACY_INDEX_KEY])
+        _local_cache().clear()
         return {"success": True, "cleared": len(index)}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -425,72 +597,78 @@ def clear_all_cache():
 
 def clear_cache_for_doctype(doc, method=None):
     """
-    Clear cached results that reference a specific doctype.
+    Queue invalidation of cached results that reference a doctype.
     Called by doc_events hooks when data changes.
     Frappe passes (doc, method) — we extract the doctype from doc.
 
-    Uses a two-layer strategy:
-      Layer 1 (precise): Check the reverse index (doctype → cache keys).
-        Only deletes cache entries that actually referenced this doctype.
-      Layer 2 (fallback): If no reverse index exists (entries cached before
-        P3.6 was deployed), falls back to the old coarse prefix-matching
-        approach for core business doctypes.
+    The Redis work runs on the short queue after the transaction commits,
+    so submit/cancel doesn't wait on it. One queued job per doctype:
+    rapid saves collapse into a single invalidation. A job that has already
+    started may have read the reverse index before this save's entries
+    were cached, so a save during a running job queues a fresh one.
     """
     doctype = doc.doctype if hasattr(doc, "doctype") else str(doc)
+    job_id = f"askerp_cache_clear::{doctype}"
+    try:
+        from frappe.utils.background_jobs import get_job_status
+
+        status = get_job_status(job_id)
+        if status == "queued":
+            return  # The pending job covers this save too
+
+        running = status == "started"
+        frappe.enqueue(
+            "askerp.query_cache.clear_cache_for_doctype_bg",
+            queue="short",
+            timeout=60,
+            # Deduplicating against a running job would drop this save, so
+            # a follow-up job goes in unnamed
+            job_id=None if running else job_id,
+            deduplicate=not running,
+            enqueue_after_commit=True,
+            now=frappe.flags.in_test,
+            doctype=doctype,
+        )
+    except Exception:
+        # Queue unavailable — invalidate inline rather than serve stale data
+        clear_cache_for_doctype_bg(doctype)
+
+
+def clear_cache_for_doctype_bg(doctype):
+    """
+    Clear cached results that reference a specific doctype.
+    Background job queued by clear_cache_for_doctype.
+
+    Uses the reverse index (doctype → cache keys): only entries that
+    actually referenced this doctype are deleted. The cache is cleared on
+    every migrate, so no live entry predates the index.
+    """
     try:
         cleared = 0
 
-        # ── Layer 1: Reverse index lookup (precise) ──────────────────────
         dt_key = f"{_DOCTYPE_INDEX_PREFIX}{doctype}"
-        dt_raw = frappe.cache.get_value(dt_key)
-        dt_keys = json.loads(dt_raw) if dt_raw and isinstance(dt_raw, str) else (dt_raw if isinstance(dt_raw, list) else [])
+        dt_keys = [
+            k.decode() if isinstance(k, bytes) else k
+            # The index is written through a raw pipeline with make_key
+            # applied; RedisWrapper.smembers applies make_key itself
+            for k in frappe.cache.smembers(dt_key)
+        ]
 
         if dt_keys:
-            # Delete only cache entries that referenced this doctype
-            for cache_key in dt_keys:
-                try:
-                    frappe.cache.delete_value(cache_key)
-                    cleared += 1
-                except Exception:
-                    pass
+            # Delete only cache entries that referenced this doctype (one DEL)
+            frappe.cache.delete_value(dt_keys)
+            cleared = len(dt_keys)
+            l1 = _local_cache()
+            for k in dt_keys:
+                l1.pop(k, None)
 
             # Remove cleared keys from the main index
-            raw = frappe.cache.get_value(_INDEX_KEY)
-            index = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
-            dt_keys_set = set(dt_keys)
-            updated_index = [k for k in index if k not in dt_keys_set]
-            frappe.cache.set_value(_INDEX_KEY, json.dumps(updated_index))
+            _index_remove(dt_keys)
 
             # Clear the reverse index entry itself
             frappe.cache.delete_value(dt_key)
 
-            return {"cleared": cleared}
-
-        # ── Layer 2: Fallback — coarse prefix-matching ────────────────────
-        # For cache entries created before the reverse index was deployed,
-        # fall back to clearing all query-tool entries for core doctypes.
-        core_doctypes = resolve_core_doctypes()
-        if doctype in core_doctypes:
-            raw = frappe.cache.get_value(_INDEX_KEY)
-            index = json.loads(raw) if raw and isinstance(raw, str) else (raw if isinstance(raw, list) else [])
-
-            remaining = []
-            for key in index:
-                matched = False
-                for tool_prefix in ("query_records:", "run_sql_query:", "get_financial_summary:", "compare_periods:", "count_records:"):
-                    if f"{_CACHE_PREFIX}{tool_prefix}" in key:
-                        try:
-                            frappe.cache.delete_value(key)
-                            cleared += 1
-                        except Exception:
-                            pass
-                        matched = True
-                        break
-                if not matched:
-                    remaining.append(key)
-
-            frappe.cache.set_value(_INDEX_KEY, json.dumps(remaining))
-            return {"cleared": cleared}
+        return {"cleared": cleared}
 
     except Exception:
         pass
@@ -5,193 +5,344 @@ Allows users to schedule recurring reports that are auto-generated
 and emailed as PDF/Excel attachments.
 
 Reports are stored as "AI Scheduled Report" doctype records.
-The scheduler checks hourly which reports are due and generates them.
+The scheduler checks hourly which reports are due and queues them on the
+long background queue for generation.
 """
 
+import hashlib
+import html
+import io
 import json
 import frappe
-from datetime import datetime
+from datetime import timedelta
+from askerp.ai_engine import process_chat
+from askerp.exports import export_excel, export_pdf
 from askerp.formatting import get_trading_name
 
 
+# Columns read for a due report, by the scheduler tick and again by its job
+_REPORT_FIELDS = ["name", "user", "report_name", "report_query", "frequency",
+                  "export_format", "last_generated", "email_recipients", "description"]
+
+# Rendered report PDFs by hash of (user, title, content): a report whose answer
+# hasn't changed since the last tick reuses its File instead of re-rendering
+_PDF_CACHE_PREFIX = "askerp_report_pdf:"
+_PDF_CACHE_TTL = 86400 * 7
+
+# Report email body, filled by _email_report via str.format_map — every
+# field is HTML-escaped before it goes in
+_EMAIL_TEMPLATE = (
+    "<div style='font-family: Arial, sans-serif; max-width: 600px;'>"
+    "<h3>📊 {title}</h3>"
+    "<p>{description}</p>"
+    "<p><strong>Summary:</strong></p>"
+    "<p>{summary}</p>"
+    "<p><a href='{download_url}' style='display: inline-block; "
+    "padding: 10px 20px; background: #056839; color: white; "
+    "text-decoration: none; border-radius: 5px;'>Download {file_name}</a></p>"
+    "<hr><p style='color:#888;font-size:12px'>"
+    "This is an auto-generated scheduled report from AskERP. "
+    "Frequency: {frequency}. Ask the assistant to modify or cancel this report.</p>"
+    "</div>"
+)
+
+
 def check_scheduled_reports():
     """
     Called by Frappe scheduler (hourly).
-    Checks which scheduled reports are due and generates them.
+    Checks which scheduled reports are due and queues their generation.
     """
+    # Only active reports whose frequency has elapsed — the database does the
+    # date math, so the tick reads due rows instead of every active report.
+    # Cutoffs are bound as values so each branch is an index range on
+    # (active, frequency, last_generated); see ai_scheduled_report.py.
     now = frappe.utils.now_datetime()
-
-    # Get all active scheduled reports
-    reports = frappe.get_all(
-        "AI Scheduled Report",
-        filters={"active": 1},
-        fields=["name", "user", "report_name", "report_query",
-                "frequency", "export_format", "last_generated",
-                "email_recipients", "description"],
-    )
-
-    if not reports:
+    due = frappe.db.sql(f"""
+        SELECT {", ".join(_REPORT_FIELDS)}
+        FROM `tabAI Scheduled Report`
+        WHERE active = 1
+          AND (
+            last_generated IS NULL
+            OR (frequency = 'hourly' AND last_generated <= %(hourly)s)
+            OR (frequency = 'daily' AND last_generated <= %(daily)s)
+            OR (frequency = 'weekly' AND last_generated <= %(weekly)s)
+            OR (frequency = 'monthly' AND last_generated <= %(monthly)s)
+          )
+    """, {
+        "hourly": now - timedelta(hours=1),
+        "daily": now - timedelta(days=1),
+        "weekly": now - timedelta(days=7),
+        "monthly": now - timedelta(days=28),  # ~monthly
+    }, as_dict=True)
+
+    if not due:
         return
 
-    generated = 0
-    for report in reports:
+    # Per-tick lookups shared by every report's email: owner emails in one
+    # query (not one lookup per email), plus the brand name and site URL
+    tick = {
+        "user_emails": {
+            u.name: u.email
+            for u in frappe.get_all(
+                "User",
+                filters={"name": ["in", list({r.user for r in due})]},
+                fields=["name", "email"],
+            )
+        },
+        "trading_name": get_trading_name(),
+        "site_url": frappe.utils.get_url(),
+    }
+
+    # Reports with the same user and query go to one job so the AI engine
+    # answers them once; each job runs on the long queue, so the tick
+    # returns as soon as the work is queued
+    groups = {}
+    for report in due:
+        groups.setdefault((report.user, report.report_query), []).append(report.name)
+
+    for names in groups.values():
+        names.sort()
         try:
-            if _is_due(report, now):
-                _generate_and_deliver(report)
-                generated += 1
-        except Exception as e:
-            frappe.log_error(
-                title=f"Scheduled Report Error: {report.report_name}",
-                message=f"Report: {report.name}\nUser: {report.user}\nError: {str(e)}"
+            frappe.enqueue(
+                "askerp.scheduled_reports.generate_scheduled_reports",
+                queue="long",
+                timeout=1800,
+                # One pending job per group: a slow job isn't queued again
+                # by the next tick while its reports are still due
+                job_id=f"askerp_scheduled_report::{names[0]}",
+                deduplicate=True,
+                report_names=names,
+                tick=tick,
             )
-
-    if generated > 0:
-        frappe.db.commit()
+        except Exception:
+            # Queue unavailable — generate inline so the reports still go out
+            generate_scheduled_reports(names, tick)
 
     frappe.logger().info(
-        f"Scheduled reports check: {len(reports)} active, {generated} generated"
+        f"Scheduled reports check: {len(due)} due, {len(groups)} jobs queued"
     )
 
 
-def _is_due(report, now):
-    """Check if a report is due for generation based on frequency and last_generated."""
-    last = report.last_generated
-    frequency = report.frequency
+def generate_scheduled_reports(report_names, tick=None):
+    """
+    Background job: generate one group of due reports (same user and query),
+    then stamp last_generated and write their AI Usage Log rows in one batch.
+    Rows are re-read here, so a report deactivated since the tick is skipped.
+    """
+    group = frappe.get_all(
+        "AI Scheduled Report",
+        filters={"name": ["in", report_names], "active": 1},
+        fields=_REPORT_FIELDS,
+        order_by="name asc",
+    )
+    if not group:
+        return
 
-    if not last:
-        return True  # Never generated — run now
+    results = _generate_group(group, tick or {})
+    if results:
+        # One batched UPDATE and one INSERT for every report in the group
+        frappe.db.bulk_update(
+            "AI Scheduled Report",
+            {name: {"last_generated": r["generated_at"]} for name, r in results.items()},
+            update_modified=False,
+        )
+        _insert_usage_logs([r["usage"] for r in results.values()])
+    frappe.db.commit()
 
-    # Parse last_generated
-    if isinstance(last, str):
-        try:
-            last = datetime.strptime(last, "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-            return True
 
-    if frequency == "daily":
-        return (now - last).total_seconds() >= 86400  # 24 hours
-    elif frequency == "weekly":
-        return (now - last).total_seconds() >= 604800  # 7 days
-    elif frequency == "monthly":
-        return (now - last).days >= 28  # ~monthly
-    elif frequency == "hourly":
-        return (now - last).total_seconds() >= 3600  # 1 hour
+def _safe_generate(report, tick, chat_cache=None):
+    """
+    Generate one report. Errors are logged, never raised.
+    Returns its outcome (see _generate_and_deliver), or None.
+    """
+    try:
+        return _generate_and_deliver(report, tick, chat_cache)
+    except Exception as e:
+        frappe.log_error(
+            title=f"Scheduled Report Error: {report.report_name}",
+            message=f"Report: {report.name}\nUser: {report.user}\nError: {str(e)}"
+        )
+        return None
+
 
-    return False
+def _generate_group(group, tick):
+    """
+    Generate reports that share one (user, query): the session switches to
+    that user once for the group, the AI engine runs for the first report,
+    and the rest reuse its answer from a per-group cache.
+    Returns {report name: outcome} for the reports generated.
+    """
+    chat_cache = {}
+    results = {}
+    # Save and restore original user context to prevent contamination across groups
+    original_user = frappe.session.user
+    frappe.set_user(group[0].user)
+    try:
+        for report in group:
+            outcome = _safe_generate(report, tick, chat_cache)
+            if outcome:
+                results[report.name] = outcome
+    finally:
+        frappe.set_user(original_user)
+    return results
 
 
-def _generate_and_deliver(report):
+def _generate_and_deliver(report, tick=None, chat_cache=None):
     """
     Generate the report by running the stored query through the AI engine,
-    then export to the requested format and email it.
+    then export to the requested format and email it. The session must
+    already be switched to report.user (see _generate_group).
+    tick: per-tick lookups for the email (see _email_report).
+    chat_cache: {(user, query): result} shared by reports generated together;
+    a hit reuses that answer instead of calling the AI engine again.
+    Returns {"generated_at", "usage"} — the caller stamps last_generated
+    and writes the AI Usage Log row — or None if the AI engine gave no answer.
     """
-    from .ai_engine import process_chat
-
     user = report.user
     query = report.report_query
     export_format = (report.export_format or "pdf").lower()
 
     # Run the query through the AI engine as the report's user
-    # Save and restore original user context to prevent contamination across reports
-    original_user = frappe.session.user
-    frappe.set_user(user)
-
-    try:
-        result = process_chat(
-            user=user,
-            question=f"{query}\n\n[Auto-generate this as a scheduled report. Include key metrics and trends.]",
-        )
-    except Exception as e:
-        frappe.log_error(title="Scheduled Report AI Error", message=str(e))
-        frappe.set_user(original_user)
-        return
+    cache_key = (user, query)
+    reused = chat_cache is not None and cache_key in chat_cache
+    if reused:
+        result = chat_cache[cache_key]
+    else:
+        try:
+            result = process_chat(
+                user=user,
+                question=f"{query}\n\n[Auto-generate this as a scheduled report. Include key metrics and trends.]",
+            )
+        except Exception as e:
+            frappe.log_error(title="Scheduled Report AI Error", message=str(e))
+            return
+        if chat_cache is not None:
+            chat_cache[cache_key] = result
 
     response_text = result.get("response", "")
     if not response_text:
-        frappe.set_user(original_user)
         return
 
-    try:
-        # Export to the requested format
-        file_info = None
-        session_id = f"scheduled-report-{report.name}"
-
-        if export_format == "pdf":
-            from .exports import export_pdf
-            try:
-                file_info = export_pdf(
+    # Export to the requested format
+    file_info = None
+    session_id = f"scheduled-report-{report.name}"
+
+    if export_format == "pdf":
+        try:
+            file_info = _export_pdf_cached(user, report.report_name, response_text, session_id)
+        except Exception as e:
+            frappe.log_error(title="Scheduled Report PDF Error", message=str(e))
+    elif export_format == "excel":
+        # For Excel, try to extract tabular data from the response
+        try:
+            # Simple extraction: first table-like line is the header,
+            # the rest become rows keyed by it (export_excel reads dicts)
+            rows = _iter_table_rows(response_text)
+            columns = next(rows, None) or []
+            data = [dict(zip(columns, cells)) for cells in rows]
+
+            if data:
+                file_info = export_excel(
                     title=report.report_name,
-                    content=response_text,
+                    data=data,
+                    columns=columns,
                     session_id=session_id,
                 )
-            except Exception as e:
-                frappe.log_error(title="Scheduled Report PDF Error", message=str(e))
-        elif export_format == "excel":
-            # For Excel, try to extract tabular data from the response
-            from .exports import export_excel
-            try:
-                # Simple extraction: look for table-like data in the response
-                lines = response_text.strip().split("\n")
-                data = []
-                columns = []
-                for line in lines:
-                    if "|" in line and "---" not in line:
-                        cells = [c.strip() for c in line.split("|") if c.strip()]
-                        if not columns:
-                            columns = cells
-                        else:
-                            data.append(cells)
-
-                if data:
-                    file_info = export_excel(
-                        title=report.report_name,
-                        data=data,
-                        columns=columns,
-                        session_id=session_id,
-                    )
-                else:
-                    # Fallback: export as PDF if no tabular data found
-                    from .exports import export_pdf
-                    file_info = export_pdf(
-                        title=report.report_name,
-                        content=response_text,
-                        session_id=session_id,
-                    )
-            except Exception as e:
-                frappe.log_error(title="Scheduled Report Excel Error", message=str(e))
-
-        # Update last_generated timestamp
-        now_str = frappe.utils.now_datetime().strftime("%Y-%m-%d %H:%M:%S")
-        frappe.db.set_value("AI Scheduled Report", report.name, {
-            "last_generated": now_str,
-        }, update_modified=False)
-
-        # Email the report
-        if file_info:
-            _email_report(report, file_info, response_text)
-
-        # Log to AI Usage Log
-        try:
-            frappe.get_doc({
-                "doctype": "AI Usage Log",
-                "user": user,
-                "session_id": session_id,
-                "question": f"[SCHEDULED REPORT] {report.report_name}",
-                "model": "scheduled-report-engine",
-                "input_tokens": result.get("usage", {}).get("input_tokens", 0),
-                "output_tokens": result.get("usage", {}).get("output_tokens", 0),
-                "total_tokens": result.get("usage", {}).get("total_tokens", 0),
-                "tool_calls": result.get("tool_calls", 0),
-            }).insert(ignore_permissions=True)
+            else:
+                # Fallback: export as PDF if no tabular data found
+                file_info = _export_pdf_cached(user, report.report_name, response_text, session_id)
         except Exception as e:
-            frappe.log_error(title="Scheduled Report Log Error", message=str(e))
-    finally:
-        # Always restore original user context to prevent contamination
-        frappe.set_user(original_user)
+            frappe.log_error(title="Scheduled Report Excel Error", message=str(e))
+
+    # last_generated is stamped by the caller in one batch per job
+    generated_at = frappe.utils.now_datetime()
+
+    # Email the report
+    if file_info:
+        _email_report(report, file_info, response_text, tick)
+
+    # AI Usage Log row, inserted by the caller (a reused answer spent no tokens)
+    usage = {} if reused else result.get("usage", {})
+    return {
+        "generated_at": generated_at,
+        "usage": {
+            "user": user,
+            "session_id": session_id,
+            "question": f"[SCHEDULED REPORT] {report.report_name}",
+            "model": "scheduled-report-engine",
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            "tool_calls": 0 if reused else result.get("tool_calls", 0),
+            "creation": generated_at,
+        },
+    }
+
+
+def _export_pdf_cached(user, title, content, session_id):
+    """
+    Export content as a PDF, reusing the File rendered for identical
+    (user, title, content) on an earlier tick while that File still exists.
+    Keyed per user because the File is private to whoever rendered it.
+    A reused PDF keeps the "Generated by AskERP on …" time of its first
+    render — the content it shows is unchanged since then.
+    """
+    digest = hashlib.blake2b(
+        f"{user}\0{title}\0{content}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+    key = f"{_PDF_CACHE_PREFIX}{digest}"
+    file_info = frappe.cache.get_value(key)
+    if file_info and frappe.db.exists("File", {"file_url": file_info.get("file_url")}):
+        return file_info
+
+    file_info = export_pdf(title=title, content=content, session_id=session_id)
+    if file_info:
+        frappe.cache.set_value(key, file_info, expires_in_sec=_PDF_CACHE_TTL)
+    return file_info
+
 
+def _insert_usage_logs(logs):
+    """
+    Write the tick's AI Usage Log rows with one INSERT.
+    Skips the per-document insert machinery — these rows carry no cost,
+    so the monthly-spend hook has nothing to add.
+    """
+    fields = ["name", "owner", "modified_by", "creation", "modified", "docstatus",
+              "user", "session_id", "question", "model",
+              "input_tokens", "output_tokens", "total_tokens", "tool_calls"]
+    values = [
+        [frappe.generate_hash(length=10), log["user"], log["user"],
+         log["creation"], log["creation"], 0,
+         log["user"], log["session_id"], log["question"], log["model"],
+         log["input_tokens"], log["output_tokens"], log["total_tokens"], log["tool_calls"]]
+        for log in logs
+    ]
+    try:
+        frappe.db.bulk_insert("AI Usage Log", fields, values)
+    except Exception as e:
+        frappe.log_error(title="Scheduled Report Log Error", message=str(e))
 
-def _email_report(report, file_info, summary_text):
-    """Email the generated report to configured recipients."""
+
+def _iter_table_rows(text):
+    """
+    Yield the cells of each markdown table line in text, one line at a time
+    (separator lines like |---|---| are skipped).
+    """
+    for line in io.StringIO(text):
+        if "|" in line and "---" not in line:
+            cells = [c.strip() for c in line.split("|") if c.strip()]
+            if cells:
+                yield cells
+
+
+def _email_report(report, file_info, summary_text, tick=None):
+    """
+    Email the generated report to configured recipients.
+    tick: per-tick lookups from check_scheduled_reports ("user_emails",
+    "trading_name", "site_url"); anything absent is looked up here.
+    """
+    tick = tick or {}
+    user_emails = tick.get("user_emails") or {}
     recipients = []
 
     # Parse recipients (comma-separated emails)
@@ -199,7 +350,10 @@ def _email_report(report, file_info, summary_text):
         recipients = [e.strip() for e in report.email_recipients.split(",") if e.strip()]
 
     # Always include the report owner
-    user_email = frappe.db.get_value("User", report.user, "email")
+    if report.user in user_emails:
+        user_email = user_emails[report.user]
+    else:
+        user_email = frappe.db.get_value("User", report.user, "email")
     if user_email and user_email not in recipients:
         recipients.insert(0, user_email)
 
@@ -211,28 +365,26 @@ def _email_report(report, file_info, summary_text):
     file_name = file_info.get("file_name", "report")
     download_url = file_info.get("download_url", file_url)
 
-    site_url = frappe.utils.get_url()
+    site_url = tick.get("site_url") or frappe.utils.get_url()
     full_download_url = f"{site_url}{download_url}" if download_url.startswith("/") else download_url
 
     try:
         frappe.sendmail(
             recipients=recipients,
-            subject=f"{get_trading_name()} Report: {report.report_name}",
-            message=(
-                f"<div style='font-family: Arial, sans-serif; max-width: 600px;'>"
-                f"<h3>📊 {report.report_name}</h3>"
-                f"<p>{report.description or ''}</p>"
-                f"<p><strong>Summary:</strong></p>"
-                f"<p>{summary_text[:500]}{'...' if len(summary_text) > 500 else ''}</p>"
-                f"<p><a href='{full_download_url}' style='display: inline-block; "
-                f"padding: 10px 20px; background: #056839; color: white; "
-                f"text-decoration: none; border-radius: 5px;'>Download {file_name}</a></p>"
-                f"<hr><p style='color:#888;font-size:12px'>"
-                f"This is an auto-generated scheduled report from AskERP. "
-                f"Frequency: {report.frequency}. Ask the assistant to modify or cancel this report.</p>"
-                f"</div>"
-            ),
-            now=True,
+            subject=f"{tick.get('trading_name') or get_trading_name()} Report: {report.report_name}",
+            message=_EMAIL_TEMPLATE.format_map({
+                key: html.escape(str(value)) for key, value in {
+                    "title": report.report_name,
+                    "description": report.description or "",
+                    "summary": summary_text[:500] + ("..." if len(summary_text) > 500 else ""),
+                    "download_url": full_download_url,
+                    "file_name": file_name,
+                    "frequency": report.frequency,
+                }.items()
+            }),
+            # Queue rather than send inline: Frappe's email queue flush delivers
+            # the whole tick's reports, instead of a fresh SMTP login per report
+            now=False,
         )
     except Exception as e:
         frappe.log_error(title="Scheduled Report Email Error", message=str(e))
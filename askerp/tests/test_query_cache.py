@@ -0,0 +1,36 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from askerp import query_cache
+
+
+class TestQueryCacheInvalidation(FrappeTestCase):
+    def setUp(self):
+        # Enabled, 15 min TTL, 500 entries — bypasses AskERP Settings
+        frappe.local.askerp_query_cache_settings = (True, 900, 500)
+        query_cache.clear_all_cache()
+
+    def tearDown(self):
+        query_cache.clear_all_cache()
+        frappe.local.askerp_query_cache_settings = None
+
+    def test_doctype_event_clears_cached_entry(self):
+        tool_input = {"doctype": "Sales Invoice", "filters": {"docstatus": 1}}
+        query_cache.set_cached_result("query_records", tool_input, {"data": [{"name": "SINV-0001"}]})
+        key = query_cache._make_cache_key("query_records", tool_input)
+        self.assertIsNotNone(frappe.cache.get_value(key))
+
+        # Same entry point the Sales Invoice on_submit hook calls
+        query_cache.clear_cache_for_doctype(frappe._dict(doctype="Sales Invoice"), "on_submit")
+
+        self.assertIsNone(frappe.cache.get_value(key))
+        self.assertIsNone(query_cache.get_cached_result("query_records", tool_input))
+
+    def test_other_doctype_event_keeps_entry(self):
+        tool_input = {"doctype": "Sales Invoice", "filters": {"docstatus": 1}}
+        query_cache.set_cached_result("query_records", tool_input, {"data": []})
+        key = query_cache._make_cache_key("query_records", tool_input)
+
+        query_cache.clear_cache_for_doctype(frappe._dict(doctype="Stock Entry"), "on_submit")
+
+        self.assertIsNotNone(frappe.cache.get_value(key))
@@ -89,7 +89,17 @@ def _clear_all_caches():
       - askerp:credit_notified:*    — Credit notification dedup
       - askerp_stream:*             — Streaming response data
       - askerp_cache:*              — Query cache entries (query_cache.py)
-      - askerp_cache_index          — Query cache index
+      - askerp_cache_lru            — Query cache LRU index (sorted set)
+      - askerp_cache_index          — Legacy query cache index
+      - askerp_cache_dtset:{dt}     — Query cache reverse index per doctype (set)
+      - askerp_cache_dt:{dt}        — Legacy query cache reverse index
+      - askerp_cache_daily:{day}    — Query cache hit/miss counters (hash per day)
+      - askerp_cache_count:*        — Legacy query cache hit/miss counters
+      - askerp_cache_stats:*        — Legacy query cache hit/miss counters
+      - askerp_memory_context_{u}   — Memory context per user (memory.py)
+      - askerp_report_pdf:{hash}    — Rendered scheduled report PDFs (scheduled_reports.py)
+      - askerp_user_restricted_model_{u} — Model restriction per user (providers.py)
+      - askerp_monthly_spend:{YYYY-MM}  — Month-to-date AI spend counter (providers.py)
     """
     # Known fixed cache keys
     fixed_keys = [
@@ -97,6 +107,7 @@ def _clear_all_caches():
         "askerp_setup_complete",
         "askerp_custom_tools_defs",
         "askerp_settings_cache",
+        "askerp_cache_lru",
         "askerp_cache_index",
     ]
 
@@ -108,12 +119,23 @@ def _clear_all_caches():
 
     # Dynamic cache keys — clear by pattern using Redis SCAN
     # This catches all askerp_custom_tool_*, askerp_prompt_template_*,
-    # askerp:credit_*, askerp_stream:*, askerp_cache:* keys
+    # askerp:credit_*, askerp_stream:*, askerp_cache:*, askerp_memory_context_*,
+    # askerp_user_restricted_model_*, askerp_monthly_spend:*, askerp_cache_dt*,
+    # askerp_cache_daily:*, askerp_cache_count:*, askerp_cache_stats:*,
+    # askerp_report_pdf:* keys
     _clear_cache_by_pattern("askerp_custom_tool_*")
     _clear_cache_by_pattern("askerp_prompt_template_*")
     _clear_cache_by_pattern("askerp:credit_*")
     _clear_cache_by_pattern("askerp_stream:*")
     _clear_cache_by_pattern("askerp_cache:*")
+    _clear_cache_by_pattern("askerp_memory_context_*")
+    _clear_cache_by_pattern("askerp_user_restricted_model_*")
+    _clear_cache_by_pattern("askerp_monthly_spend:*")
+    _clear_cache_by_pattern("askerp_cache_dt*")
+    _clear_cache_by_pattern("askerp_cache_daily:*")
+    _clear_cache_by_pattern("askerp_cache_count:*")
+    _clear_cache_by_pattern("askerp_cache_stats:*")
+    _clear_cache_by_pattern("askerp_report_pdf:*")
 
     print("  All AskERP cache entries cleared.")
 